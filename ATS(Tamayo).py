@@ -1,23 +1,60 @@
 import flet as ft
+import asyncio
 import heapq
+import bisect
+import math
+import random
+import sys
+from time import perf_counter, sleep, time as now_seconds
+from array import array
 import requests
+from requests.adapters import HTTPAdapter
 import matplotlib.pyplot as plt
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
 from io import BytesIO
 import base64
-from datetime import datetime, timedelta
+import hashlib
+import pickle
+import json
+import sqlite3
+import threading
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
 from dataclasses import dataclass, field, asdict
-from typing import List, Dict, Optional
+from typing import List, Dict, Optional, Tuple
 import os
+import csv
+import re
 from dotenv import load_dotenv
 import bcrypt
-from pymongo import MongoClient
-from pymongo.errors import ConnectionFailure, PyMongoError
+from bson import ObjectId
+from pymongo import MongoClient, ReturnDocument, UpdateOne
+from pymongo.errors import ConnectionFailure, DuplicateKeyError, OperationFailure, PyMongoError
+
+try:
+    from scipy.optimize import linear_sum_assignment
+except ImportError:  # scipy is optional; solve_assignment falls back to numpy
+    linear_sum_assignment = None
 
 # Load environment variables
 load_dotenv()
 GOOGLE_MAPS_API_KEY = os.getenv("GOOGLE_MAPS_API_KEY")
+ROUTING_PROVIDER_URL = os.getenv("ROUTING_PROVIDER_URL", "https://maps.googleapis.com/maps/api/directions/json")
+ROUTING_CONNECT_TIMEOUT = float(os.getenv("ROUTING_CONNECT_TIMEOUT", "3.05"))  # seconds
+ROUTING_READ_TIMEOUT = float(os.getenv("ROUTING_READ_TIMEOUT", "10"))  # seconds
+ROUTING_RETRIES = int(os.getenv("ROUTING_RETRIES", "2"))
+DISPATCH_INTERVAL = float(os.getenv("DISPATCH_INTERVAL", "0"))  # seconds, 0 disables
+POOL_RIDES = os.getenv("POOL_RIDES", "").lower() in ("1", "true", "yes")
+NEAREST_DRIVERS = int(os.getenv("NEAREST_DRIVERS", "5"))  # drivers routed exactly per booking
 MONGO_URI = os.getenv("MONGO_URI", "mongodb://localhost:27017")
 DB_NAME = "accessible_transport"
+ROUTING_ALGORITHM = os.getenv("ROUTING_ALGORITHM", "dijkstra")
+ROUTE_HIERARCHY_PATH = os.getenv("ROUTE_HIERARCHY_PATH")
+PRECOMPUTE_ROUTES = os.getenv("PRECOMPUTE_ROUTES", "").lower() in ("1", "true", "yes")
+ROUTE_CACHE_DIR = os.getenv("ROUTE_CACHE_DIR", ".route_cache")
+ROUTE_CACHE_PATH = os.getenv("ROUTE_CACHE_PATH", os.path.join(ROUTE_CACHE_DIR, "routes.sqlite3"))
+ROUTE_CACHE_TTL = int(os.getenv("ROUTE_CACHE_TTL", str(6 * 3600)))  # seconds
 
 # MongoDB Setup
 client = MongoClient(MONGO_URI)
@@ -32,6 +69,7 @@ db = client[DB_NAME]
 users_collection = db["users"]
 rides_collection = db["rides"]
 drivers_collection = db["drivers"]
+rollups_collection = db["ride_rollups"]
 
 # Data Models
 @dataclass
@@ -55,18 +93,56 @@ class User:
             created_at=data.get("created_at", datetime.now())
         )
 
+# Structured vehicle capabilities, derived from the free-text vehicle_type
+VEHICLE_FEATURES = {
+    "wheelchair_ramp": ("wheelchair ramp", "ramp"),
+    "wheelchair_lift": ("wheelchair lift", "lift"),
+    "van": ("van",),
+    "sedan": ("sedan",),
+}
+
+# Ride requirement keywords -> vehicle feature they need
+REQUIREMENT_FEATURES = {
+    "wheelchair": "wheelchair_ramp",
+}
+
+def vehicle_features_for(vehicle_type: str) -> List[str]:
+    text = vehicle_type.lower()
+    return sorted(feature for feature, keywords in VEHICLE_FEATURES.items()
+                  if any(keyword in text for keyword in keywords))
+
+def required_features(requirements: List[str]) -> List[str]:
+    needed = set()
+    for requirement in requirements:
+        text = requirement.strip().lower()
+        for keyword, feature in REQUIREMENT_FEATURES.items():
+            if keyword in text:
+                needed.add(feature)
+    return sorted(needed)
+
 @dataclass
 class Driver(User):
     vehicle_type: str = ""
     capacity: int = 4
     availability: bool = True
+    vehicle_features: List[str] = field(default_factory=list)
+    current_location: str = ""
+    position: Optional[Tuple[float, float]] = None  # (longitude, latitude)
+    
+    def __post_init__(self):
+        if not self.vehicle_features:
+            self.vehicle_features = vehicle_features_for(self.vehicle_type)
     
     def to_dict(self):
         data = super().to_dict()
         data.update({
             "vehicle_type": self.vehicle_type,
             "capacity": self.capacity,
-            "availability": self.availability
+            "availability": self.availability,
+            "vehicle_features": self.vehicle_features,
+            "current_location": self.current_location,
+            # GeoJSON so the 2dsphere index can serve $near queries
+            "position": {"type": "Point", "coordinates": list(self.position)} if self.position else None
         })
         return data
     
@@ -80,7 +156,10 @@ class Driver(User):
             created_at=data.get("created_at", datetime.now()),
             vehicle_type=data.get("vehicle_type", ""),
             capacity=data.get("capacity", 4),
-            availability=data.get("availability", True)
+            availability=data.get("availability", True),
+            vehicle_features=data.get("vehicle_features", []),
+            current_location=data.get("current_location", ""),
+            position=tuple(data["position"]["coordinates"]) if data.get("position") else None
         )
 
 @dataclass
@@ -95,71 +174,2988 @@ class RideRequest:
     estimated_time: Optional[int] = None
     distance: Optional[float] = None
     created_at: datetime = field(default_factory=datetime.now)
+    passengers: int = 1
+    route_order: Optional[int] = None  # stop number in the driver's planned day
+    
+    def to_dict(self):
+        return asdict(self)
+    
+    @classmethod
+    def from_dict(cls, data):
+        return cls(
+            user_id=data["user_id"],
+            pickup=data["pickup"],
+            dropoff=data["dropoff"],
+            scheduled_time=data["scheduled_time"],
+            status=data.get("status", "pending"),
+            accessibility_requirements=data.get("accessibility_requirements", []),
+            driver_id=data.get("driver_id"),
+            estimated_time=data.get("estimated_time"),
+            distance=data.get("distance"),
+            created_at=data.get("created_at", datetime.now()),
+            passengers=data.get("passengers", 1),
+            route_order=data.get("route_order")
+        )
+
+# Transportation Graph for route optimization
+class TransportationGraph:
+    def __init__(self):
+        self.nodes = {}
+        self.edges = {}
+        
+        # Bumped on every change so derived data can tell it is stale
+        self.version = 0
+        # fingerprint() of the graph at fingerprint_version
+        self.fingerprint_version = None
+        self.fingerprint_digest = None
+        
+        # Compressed-sparse-row adjacency, rebuilt by freeze()
+        self.frozen = False
+        self.node_ids = []
+        self.node_index = {}
+        self.offsets = array("q")
+        self.targets = array("q")
+        self.weights = array("d")
+        self.times = array("d")
+        
+        # Piecewise-linear travel-time profiles, deduplicated and shared by
+        # edges: profile_ids[slot] indexes profile_offsets (-1 = constant time)
+        self.profile_ids = array("q")
+        self.profile_offsets = array("q", [0])
+        self.profile_minutes = array("d")
+        self.profile_values = array("d")
+        self.profile_minimums = array("d")
+        
+        # Reverse adjacency for backward searches
+        self.reverse_offsets = array("q")
+        self.reverse_targets = array("q")
+        self.reverse_weights = array("d")
+        
+        # Node coordinates for the A* heuristic
+        self.xs = array("d")
+        self.ys = array("d")
+        self.heuristic_scale = 0.0
+        self.time_heuristic_scale = 0.0
+        
+        # Uniform grid of node indices by coordinate cell, for nearest_node
+        self.grid = {}
+        self.grid_origin = (0.0, 0.0)
+        self.grid_cell = 1.0
+        self.grid_size = (0, 0)
+        
+        # True when no edge can be crossed faster than its weight at any time of day
+        self.free_flow_fastest = True
+        
+        # Nodes settled by the most recent search (for benchmarking)
+        self.last_settled = 0
+        
+        # Optional contraction hierarchy for fast point-to-point queries
+        self.hierarchy = None
+        
+        # Optional all-pairs table for small static networks
+        self.route_table = None
+        
+        # Location lookup: exact and normalized names, plus word-prefix and
+        # trigram postings over normalized names for partial matches and suggestions
+        self.name_index = {}
+        self.normalized_index = {}
+        self.prefix_index = {}
+        self.trigram_index = {}
+    
+    def add_node(self, node_id: int, name: str, location: str,
+                 coords: Optional[Tuple[float, float]] = None):
+        if node_id in self.nodes:
+            self.unindex_location(node_id)
+        self.nodes[node_id] = {"name": name, "location": location, "coords": coords}
+        self.index_location(node_id)
+        self.version += 1
+        self.frozen = False
+        self.hierarchy = None
+        self.route_table = None
+    
+    def add_edge(self, from_node: int, to_node: int, weight: int, time: int,
+                 profile: Optional[List[Tuple[float, float]]] = None):
+        """Add a directed edge; `profile` lists (minute of day, travel minutes) breakpoints"""
+        if profile is not None:
+            profile = self.validate_profile(profile)
+        if from_node not in self.edges:
+            self.edges[from_node] = {}
+        self.edges[from_node][to_node] = {"weight": weight, "time": time, "profile": profile}
+        self.version += 1
+        self.frozen = False
+        self.hierarchy = None
+        self.route_table = None
+    
+    def update_edge(self, from_node: int, to_node: int, weight: int, time: Optional[int] = None):
+        """Re-weight (or open) an edge, repairing derived tables instead of rebuilding them"""
+        existing = self.edges.get(from_node, {}).get(to_node)
+        profile = None
+        if existing is None:
+            time = weight if time is None else time
+        else:
+            # Travel time, and any rush-hour profile with it, follows the new weight unless given
+            if time is None:
+                time = existing["time"] * weight / existing["weight"] if existing["weight"] else weight
+            if existing["profile"] is not None and existing["time"]:
+                factor = time / existing["time"]
+                profile = self.validate_profile([(minute, minutes * factor) for minute, minutes in existing["profile"]])
+        self.edges.setdefault(from_node, {})[to_node] = {"weight": weight, "time": time, "profile": profile}
+        self.apply_edge_change(from_node, to_node, existing["weight"] if existing else None, weight)
+    
+    def remove_edge(self, from_node: int, to_node: int):
+        """Close an edge, repairing derived tables instead of rebuilding them"""
+        existing = self.edges.get(from_node, {}).pop(to_node, None)
+        if existing is None:
+            raise KeyError(f"No edge from {from_node} to {to_node}")
+        self.apply_edge_change(from_node, to_node, existing["weight"], None)
+    
+    def apply_edge_change(self, from_node: int, to_node: int,
+                          old_weight: Optional[int], new_weight: Optional[int]):
+        """Bring the CSR arrays and derived tables up to date after one edge changed"""
+        self.version += 1
+        # Contraction order depends on every weight; rebuilt on the next "ch" query
+        self.hierarchy = None
+        table = self.route_table
+        
+        patched = False
+        if self.frozen:
+            patched = self.patch_edge(from_node, to_node)
+        if not patched:
+            previous_ids = self.node_ids
+            self.freeze()
+            if self.node_ids != previous_ids:
+                table = self.route_table = None
+        
+        if table is not None:
+            table.repair(self, self.node_index[from_node], self.node_index[to_node],
+                         float('inf') if old_weight is None else old_weight,
+                         float('inf') if new_weight is None else new_weight)
+    
+    def patch_edge(self, from_node: int, to_node: int) -> bool:
+        """Rewrite one edge in the frozen arrays; False when it needs a new slot or its profile a re-freeze"""
+        if from_node not in self.node_index or to_node not in self.node_index:
+            return False
+        source = self.node_index[from_node]
+        target = self.node_index[to_node]
+        edge_data = self.edges.get(from_node, {}).get(to_node)
+        slots = [slot for slot in range(self.offsets[source], self.offsets[source + 1])
+                 if self.targets[slot] == target]
+        if not slots:
+            return False
+        
+        if edge_data is None:
+            # Closed: the slot stays as an infinite-weight tombstone that every search skips,
+            # and a later reopening patches it back; the next full freeze() drops it
+            for slot in slots:
+                self.weights[slot] = float('inf')
+                self.times[slot] = float('inf')
+                self.profile_ids[slot] = -1
+            for slot in range(self.reverse_offsets[target], self.reverse_offsets[target + 1]):
+                if self.reverse_targets[slot] == source:
+                    self.reverse_weights[slot] = float('inf')
+            return True
+        
+        # Profiles are deduplicated across edges, so they can't be patched per slot
+        if edge_data["profile"] is not None or any(self.profile_ids[slot] != -1 for slot in slots):
+            return False
+        
+        for slot in slots:
+            self.weights[slot] = edge_data["weight"]
+            self.times[slot] = edge_data["time"]
+        for slot in range(self.reverse_offsets[target], self.reverse_offsets[target + 1]):
+            if self.reverse_targets[slot] == source:
+                self.reverse_weights[slot] = edge_data["weight"]
+        
+        # A cheaper edge can break the A* bounds; lowering the scales keeps them admissible
+        length = math.hypot(self.xs[source] - self.xs[target], self.ys[source] - self.ys[target])
+        if length > 0:
+            self.heuristic_scale = min(self.heuristic_scale, edge_data["weight"] / length)
+            self.time_heuristic_scale = min(self.time_heuristic_scale, edge_data["time"] / length)
+        if edge_data["time"] < edge_data["weight"]:
+            self.free_flow_fastest = False
+        return True
+    
+    @staticmethod
+    def normalize_name(name: str) -> str:
+        return " ".join(re.sub(r"[^a-z0-9]+", " ", name.lower()).split())
+    
+    @staticmethod
+    def trigrams(text: str) -> set:
+        return {text[i:i + 3] for i in range(len(text) - 2)}
+    
+    def location_keys(self, node_id: int) -> tuple:
+        """Index keys for a node: (exact names, normalized names, prefixes, trigrams)"""
+        node = self.nodes[node_id]
+        names = {node["name"], node["location"]}
+        normalized = {self.normalize_name(name) for name in names}
+        prefixes = {word[:length] for text in normalized for word in text.split() for length in (1, 2)}
+        trigrams = set().union(*(self.trigrams(text) for text in normalized))
+        return names, normalized, prefixes, trigrams
+    
+    def index_location(self, node_id: int):
+        names, normalized, prefixes, trigrams = self.location_keys(node_id)
+        for name in names:
+            self.name_index[name] = node_id
+        for text in normalized:
+            self.normalized_index[text] = node_id
+        for prefix in prefixes:
+            self.prefix_index.setdefault(prefix, set()).add(node_id)
+        for trigram in trigrams:
+            self.trigram_index.setdefault(trigram, set()).add(node_id)
+    
+    def unindex_location(self, node_id: int):
+        names, normalized, prefixes, trigrams = self.location_keys(node_id)
+        for name in names:
+            if self.name_index.get(name) == node_id:
+                del self.name_index[name]
+        for text in normalized:
+            if self.normalized_index.get(text) == node_id:
+                del self.normalized_index[text]
+        for prefix in prefixes:
+            self.prefix_index.get(prefix, set()).discard(node_id)
+        for trigram in trigrams:
+            self.trigram_index.get(trigram, set()).discard(node_id)
+    
+    def find_location(self, query: str) -> Optional[int]:
+        """Resolve a location string to a node ID: exact, normalized, then substring match"""
+        if query in self.name_index:
+            return self.name_index[query]
+        
+        text = self.normalize_name(query)
+        if not text:
+            return None
+        if text in self.normalized_index:
+            return self.normalized_index[text]
+        
+        query_trigrams = self.trigrams(text)
+        if not query_trigrams:
+            candidates = self.prefix_index.get(text, set())
+        else:
+            postings = sorted((self.trigram_index.get(trigram, set()) for trigram in query_trigrams), key=len)
+            candidates = set.intersection(*postings)
+        
+        # Names containing the query; prefer the shortest (closest) match
+        containing = [node_id for node_id in candidates
+                      if text in self.normalize_name(self.nodes[node_id]["name"])]
+        if containing:
+            return min(containing, key=lambda node_id: len(self.nodes[node_id]["name"]))
+        return None
+    
+    def suggest_location(self, query: str, limit: int = 3) -> List[int]:
+        """Close but unconfirmed matches for an unknown location, best first (never used for routing)"""
+        query_trigrams = self.trigrams(self.normalize_name(query or ""))
+        if not query_trigrams:
+            return []
+        
+        # Most query trigrams found in the name, ties to the shortest name
+        scores = {}
+        for trigram in query_trigrams:
+            for node_id in self.trigram_index.get(trigram, ()):
+                scores[node_id] = scores.get(node_id, 0) + 1
+        ranked = sorted(scores, key=lambda node_id: (-scores[node_id], len(self.nodes[node_id]["name"])))
+        return [node_id for node_id in ranked[:limit] if scores[node_id] / len(query_trigrams) >= 0.5]
+    
+    def nearest_node(self, coords: Tuple[float, float]) -> Optional[int]:
+        """Node closest to (x, y) in straight-line terms, or None if nodes have no coordinates"""
+        if not self.frozen:
+            self.freeze()
+        if not self.grid:
+            return None
+        
+        # Search rings of grid cells outward (clipped to the grid) until no closer node can remain
+        cell = self.grid_cell
+        columns, rows = self.grid_size
+        center_x = math.floor((coords[0] - self.grid_origin[0]) / cell)
+        center_y = math.floor((coords[1] - self.grid_origin[1]) / cell)
+        best, best_distance = -1, float('inf')
+        ring = max(0, -center_x, center_x - columns, -center_y, center_y - rows)
+        last_ring = max(center_x, columns - center_x, center_y, rows - center_y)
+        while ring <= last_ring:
+            # Nodes from this ring outward are more than ring - 1 cells away on one axis
+            if best_distance <= (ring - 1) * cell:
+                break
+            for x in range(max(center_x - ring, 0), min(center_x + ring, columns) + 1):
+                if abs(x - center_x) == ring:
+                    column = range(max(center_y - ring, 0), min(center_y + ring, rows) + 1)
+                else:
+                    column = {center_y - ring, center_y + ring}
+                for y in column:
+                    for i in self.grid.get((x, y), ()):
+                        distance = math.hypot(self.xs[i] - coords[0], self.ys[i] - coords[1])
+                        if (distance, i) < (best_distance, best):
+                            best, best_distance = i, distance
+            ring += 1
+        return self.node_ids[best]
+    
+    @staticmethod
+    def validate_profile(profile: List[Tuple[float, float]]) -> tuple:
+        """Check a daily travel-time profile is sorted and FIFO (no overtaking by leaving later)"""
+        points = tuple((float(minute), float(minutes)) for minute, minutes in profile)
+        if not points:
+            raise ValueError("Travel-time profile needs at least one breakpoint")
+        wrapped = points + ((points[0][0] + 1440, points[0][1]),)
+        for (t1, v1), (t2, v2) in zip(wrapped, wrapped[1:]):
+            if not 0 <= t1 < 1440 or t2 <= t1:
+                raise ValueError("Profile minutes must be increasing within one day")
+            if v1 < 0 or (v2 - v1) / (t2 - t1) < -1:
+                raise ValueError("Profile travel times must be non-negative and FIFO")
+        return points
+    
+    def freeze(self) -> "TransportationGraph":
+        """Pack the edge dicts into contiguous CSR arrays used by the searches"""
+        node_ids = list(self.nodes)
+        known = set(node_ids)
+        for from_node, neighbors in self.edges.items():
+            for node_id in (from_node, *neighbors):
+                if node_id not in known:
+                    known.add(node_id)
+                    node_ids.append(node_id)
+        
+        node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        offsets = array("q", [0])
+        targets = array("q")
+        weights = array("d")
+        times = array("d")
+        profile_ids = array("q")
+        profile_offsets = array("q", [0])
+        profile_minutes = array("d")
+        profile_values = array("d")
+        profile_minimums = array("d")
+        shared_profiles = {}
+        
+        for node_id in node_ids:
+            for neighbor, edge_data in self.edges.get(node_id, {}).items():
+                targets.append(node_index[neighbor])
+                weights.append(edge_data["weight"])
+                times.append(edge_data["time"])
+                
+                profile = edge_data.get("profile")
+                if profile is None:
+                    profile_ids.append(-1)
+                    continue
+                if profile not in shared_profiles:
+                    shared_profiles[profile] = len(profile_offsets) - 1
+                    for minute, minutes in profile:
+                        profile_minutes.append(minute)
+                        profile_values.append(minutes)
+                    profile_offsets.append(len(profile_minutes))
+                    profile_minimums.append(min(minutes for _, minutes in profile))
+                profile_ids.append(shared_profiles[profile])
+            offsets.append(len(targets))
+        
+        free_flow_fastest = all(
+            (times[slot] if profile_ids[slot] == -1 else profile_minimums[profile_ids[slot]]) >= weights[slot]
+            for slot in range(len(targets))
+        )
+        
+        # Reverse CSR: bucket every edge by its target node
+        reverse_offsets = array("q", [0] * (len(node_ids) + 1))
+        for target in targets:
+            reverse_offsets[target + 1] += 1
+        for i in range(len(node_ids)):
+            reverse_offsets[i + 1] += reverse_offsets[i]
+        
+        reverse_targets = array("q", [0] * len(targets))
+        reverse_weights = array("d", [0.0] * len(targets))
+        fill = array("q", reverse_offsets[:-1])
+        for source in range(len(node_ids)):
+            for slot in range(offsets[source], offsets[source + 1]):
+                target = targets[slot]
+                reverse_targets[fill[target]] = source
+                reverse_weights[fill[target]] = weights[slot]
+                fill[target] += 1
+        
+        # Coordinates and the largest scale that keeps the A* heuristic
+        # admissible (straight-line distance never overestimates any edge)
+        coords = [self.nodes.get(node_id, {}).get("coords") for node_id in node_ids]
+        xs = array("d", [0.0] * len(node_ids))
+        ys = array("d", [0.0] * len(node_ids))
+        heuristic_scale = 0.0
+        time_heuristic_scale = 0.0
+        grid = {}
+        grid_origin, grid_cell, grid_size = (0.0, 0.0), 1.0, (0, 0)
+        if coords and all(coord is not None for coord in coords):
+            for i, (x, y) in enumerate(coords):
+                xs[i] = x
+                ys[i] = y
+            
+            # About one node per cell on an evenly spread network
+            grid_origin = (min(xs), min(ys))
+            extent = max(max(xs) - grid_origin[0], max(ys) - grid_origin[1])
+            grid_cell = extent / math.isqrt(len(node_ids)) if extent > 0 else 1.0
+            for i in range(len(node_ids)):
+                grid.setdefault((math.floor((xs[i] - grid_origin[0]) / grid_cell),
+                                 math.floor((ys[i] - grid_origin[1]) / grid_cell)), []).append(i)
+            grid_size = (max(x for x, _ in grid), max(y for _, y in grid))
+            
+            heuristic_scale = float('inf')
+            time_heuristic_scale = float('inf')
+            for source in range(len(node_ids)):
+                for slot in range(offsets[source], offsets[source + 1]):
+                    target = targets[slot]
+                    length = math.hypot(xs[source] - xs[target], ys[source] - ys[target])
+                    if length > 0:
+                        heuristic_scale = min(heuristic_scale, weights[slot] / length)
+                        fastest = times[slot] if profile_ids[slot] == -1 else profile_minimums[profile_ids[slot]]
+                        time_heuristic_scale = min(time_heuristic_scale, fastest / length)
+            if heuristic_scale == float('inf'):
+                heuristic_scale = 0.0
+            if time_heuristic_scale == float('inf'):
+                time_heuristic_scale = 0.0
+        
+        self.node_ids = node_ids
+        self.node_index = node_index
+        self.offsets = offsets
+        self.targets = targets
+        self.weights = weights
+        self.times = times
+        self.profile_ids = profile_ids
+        self.profile_offsets = profile_offsets
+        self.profile_minutes = profile_minutes
+        self.profile_values = profile_values
+        self.profile_minimums = profile_minimums
+        self.reverse_offsets = reverse_offsets
+        self.reverse_targets = reverse_targets
+        self.reverse_weights = reverse_weights
+        self.xs = xs
+        self.ys = ys
+        self.grid = grid
+        self.grid_origin = grid_origin
+        self.grid_cell = grid_cell
+        self.grid_size = grid_size
+        self.heuristic_scale = heuristic_scale
+        self.time_heuristic_scale = time_heuristic_scale
+        self.free_flow_fastest = free_flow_fastest
+        self.frozen = True
+        return self
+    
+    def fingerprint(self) -> str:
+        """Hash of the frozen topology and weights, used to key on-disk caches"""
+        if not self.frozen:
+            self.freeze()
+        if self.fingerprint_version == self.version:
+            return self.fingerprint_digest
+        digest = hashlib.sha256()
+        digest.update(repr(self.node_ids).encode())
+        for values in (self.offsets, self.targets, self.weights, self.times, self.profile_ids,
+                       self.profile_offsets, self.profile_minutes, self.profile_values):
+            digest.update(values.tobytes())
+        self.fingerprint_version = self.version
+        self.fingerprint_digest = digest.hexdigest()
+        return self.fingerprint_digest
+    
+    def build_hierarchy(self) -> "ContractionHierarchy":
+        """Contract the frozen graph and keep the hierarchy for "ch" queries"""
+        if not self.frozen:
+            self.freeze()
+        self.hierarchy = ContractionHierarchy.build(self)
+        return self.hierarchy
+    
+    def load_hierarchy(self, path: str) -> bool:
+        """Load a persisted hierarchy if it was built for this exact graph"""
+        try:
+            hierarchy = ContractionHierarchy.load(path)
+        except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+            return False
+        if hierarchy.fingerprint != self.fingerprint():
+            return False
+        self.hierarchy = hierarchy
+        return True
+    
+    def precompute_routes(self, cache_dir: Optional[str] = None) -> "RouteTable":
+        """Build (or reload from cache_dir) the all-pairs table used by "table" queries"""
+        if not self.frozen:
+            self.freeze()
+        self.route_table = RouteTable.load_or_build(self, cache_dir)
+        self.route_table.version = self.version
+        return self.route_table
+    
+    def unpack_path(self, previous: list, target: int) -> list:
+        """Walk a predecessor array back from target and return node IDs"""
+        path = []
+        current = target
+        while current != -1:
+            path.append(self.node_ids[current])
+            current = previous[current]
+        
+        path.reverse()
+        return path
+    
+    def shortest_path(self, start: int, end: int, algorithm: str = "dijkstra") -> tuple:
+        """Point-to-point route using "dijkstra", "astar", "bidirectional", "ch" or "table" lookup"""
+        searches = {
+            "dijkstra": self.dijkstra,
+            "astar": self.astar,
+            "bidirectional": self.bidirectional,
+            "ch": self.contracted,
+            "table": self.table_lookup,
+        }
+        if algorithm not in searches:
+            raise ValueError(f"Unknown shortest path algorithm: {algorithm}")
+        return searches[algorithm](start, end)
+    
+    def dijkstra(self, start: int, end: int) -> tuple:
+        if not self.frozen:
+            self.freeze()
+        
+        source = self.node_index[start]
+        target = self.node_index[end]
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        
+        distances = [float('inf')] * len(self.node_ids)
+        previous_nodes = [-1] * len(self.node_ids)
+        distances[source] = 0
+        settled = 0
+        
+        priority_queue = [(0, source)]
+        
+        while priority_queue:
+            current_distance, current_node = heapq.heappop(priority_queue)
+            
+            if current_distance > distances[current_node]:
+                continue
+            
+            settled += 1
+            if current_node == target:
+                break
+                
+            for slot in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[slot]
+                distance = current_distance + weights[slot]
+                if distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    previous_nodes[neighbor] = current_node
+                    heapq.heappush(priority_queue, (distance, neighbor))
+        
+        self.last_settled = settled
+        return self.unpack_path(previous_nodes, target), distances[target]
+    
+    def astar(self, start: int, end: int) -> tuple:
+        """A* search guided by straight-line distance to the destination"""
+        if not self.frozen:
+            self.freeze()
+        
+        source = self.node_index[start]
+        target = self.node_index[end]
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        xs, ys, scale = self.xs, self.ys, self.heuristic_scale
+        target_x, target_y = xs[target], ys[target]
+        
+        distances = [float('inf')] * len(self.node_ids)
+        previous_nodes = [-1] * len(self.node_ids)
+        distances[source] = 0
+        settled = 0
+        
+        priority_queue = [(scale * math.hypot(xs[source] - target_x, ys[source] - target_y), 0, source)]
+        
+        while priority_queue:
+            _, current_distance, current_node = heapq.heappop(priority_queue)
+            
+            if current_distance > distances[current_node]:
+                continue
+            
+            settled += 1
+            if current_node == target:
+                break
+                
+            for slot in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[slot]
+                distance = current_distance + weights[slot]
+                if distance < distances[neighbor]:
+                    distances[neighbor] = distance
+                    previous_nodes[neighbor] = current_node
+                    estimate = distance + scale * math.hypot(xs[neighbor] - target_x, ys[neighbor] - target_y)
+                    heapq.heappush(priority_queue, (estimate, distance, neighbor))
+        
+        self.last_settled = settled
+        return self.unpack_path(previous_nodes, target), distances[target]
+    
+    def bidirectional(self, start: int, end: int) -> tuple:
+        """Bidirectional Dijkstra meeting in the middle via the reverse-edge index"""
+        if not self.frozen:
+            self.freeze()
+        
+        source = self.node_index[start]
+        target = self.node_index[end]
+        n = len(self.node_ids)
+        
+        forward = (self.offsets, self.targets, self.weights)
+        backward = (self.reverse_offsets, self.reverse_targets, self.reverse_weights)
+        distances = ([float('inf')] * n, [float('inf')] * n)
+        parents = ([-1] * n, [-1] * n)
+        queues = ([(0, source)], [(0, target)])
+        distances[0][source] = 0
+        distances[1][target] = 0
+        
+        best = 0 if source == target else float('inf')
+        meeting_node = source if source == target else -1
+        settled = 0
+        
+        while queues[0] and queues[1]:
+            if queues[0][0][0] + queues[1][0][0] >= best:
+                break
+            
+            side = 0 if queues[0][0][0] <= queues[1][0][0] else 1
+            offsets, targets, weights = forward if side == 0 else backward
+            own_distances, other_distances = distances[side], distances[1 - side]
+            current_distance, current_node = heapq.heappop(queues[side])
+            
+            if current_distance > own_distances[current_node]:
+                continue
+            
+            settled += 1
+            for slot in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[slot]
+                distance = current_distance + weights[slot]
+                if distance < own_distances[neighbor]:
+                    own_distances[neighbor] = distance
+                    parents[side][neighbor] = current_node
+                    heapq.heappush(queues[side], (distance, neighbor))
+                if distance + other_distances[neighbor] < best:
+                    best = distance + other_distances[neighbor]
+                    meeting_node = neighbor
+        
+        self.last_settled = settled
+        if meeting_node == -1:
+            return [end], float('inf')
+        
+        path = self.unpack_path(parents[0], meeting_node)
+        current = parents[1][meeting_node]
+        while current != -1:
+            path.append(self.node_ids[current])
+            current = parents[1][current]
+        
+        return path, best
+
+    def k_shortest_paths(self, start: int, end: int, k: int = 3, reuse_tree: bool = True) -> List[tuple]:
+        """Up to k loopless alternative routes as (path, distance), shortest first (Yen)"""
+        if not self.frozen:
+            self.freeze()
+        
+        # The reverse shortest-path tree towards end is built once and shared by
+        # every spur search; reuse_tree=False is the naive per-spur Dijkstra
+        
+        source = self.node_index[start]
+        target = self.node_index[end]
+        n = len(self.node_ids)
+        
+        if reuse_tree:
+            to_target, next_hop = shortest_path_tree(
+                self.reverse_offsets, self.reverse_targets, self.reverse_weights, target)
+        else:
+            to_target, next_hop = [0] * n, None
+        self.last_settled = 0
+        
+        first, first_cost = self.spur_path(source, target, set(), set(), to_target, next_hop)
+        if first is None:
+            return []
+        
+        found = [(first_cost, first)]
+        candidates = []
+        seen = {tuple(first)}
+        
+        while len(found) < k:
+            _, previous_path = found[-1]
+            root_cost = 0
+            for i in range(len(previous_path) - 1):
+                spur = previous_path[i]
+                root = previous_path[:i + 1]
+                banned_edges = {(path[i], path[i + 1]) for _, path in found
+                                if len(path) > i + 1 and path[:i + 1] == root}
+                banned_nodes = set(root[:-1])
+                
+                spur_path, spur_cost = self.spur_path(spur, target, banned_nodes, banned_edges, to_target, next_hop)
+                if spur_path is not None:
+                    path = root[:-1] + spur_path
+                    if tuple(path) not in seen:
+                        seen.add(tuple(path))
+                        heapq.heappush(candidates, (root_cost + spur_cost, path))
+                root_cost += self.edge_weight(previous_path[i], previous_path[i + 1])
+            
+            if not candidates:
+                break
+            found.append(heapq.heappop(candidates))
+        
+        return [([self.node_ids[node] for node in path], cost) for cost, path in found]
+    
+    def edge_weight(self, u: int, v: int) -> int:
+        """Weight of the CSR edge between node indices u and v"""
+        for slot in range(self.offsets[u], self.offsets[u + 1]):
+            if self.targets[slot] == v:
+                return self.weights[slot]
+        raise KeyError((u, v))
+    
+    def spur_path(self, spur: int, target: int, banned_nodes: set, banned_edges: set,
+                  to_target: list, next_hop: Optional[list]) -> tuple:
+        """Shortest spur->target route in index space avoiding the banned nodes/edges"""
+        if next_hop is not None:
+            # The tree route is optimal whenever nothing on it is banned
+            path = [spur]
+            current = spur
+            while current != target and current != -1:
+                following = next_hop[current]
+                if following in banned_nodes or (current, following) in banned_edges:
+                    break
+                path.append(following)
+                current = following
+            if current == target:
+                return path, to_target[spur]
+        
+        offsets, targets, weights = self.offsets, self.targets, self.weights
+        distances = {spur: 0}
+        previous_nodes = {spur: -1}
+        priority_queue = [(to_target[spur], 0, spur)]
+        
+        while priority_queue:
+            _, current_distance, current_node = heapq.heappop(priority_queue)
+            if current_distance > distances[current_node]:
+                continue
+            
+            self.last_settled += 1
+            if current_node == target:
+                path = []
+                while current_node != -1:
+                    path.append(current_node)
+                    current_node = previous_nodes[current_node]
+                path.reverse()
+                return path, current_distance
+            
+            for slot in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[slot]
+                if neighbor in banned_nodes or (current_node, neighbor) in banned_edges:
+                    continue
+                if to_target[neighbor] == float('inf'):
+                    continue
+                distance = current_distance + weights[slot]
+                if distance < distances.get(neighbor, float('inf')):
+                    distances[neighbor] = distance
+                    previous_nodes[neighbor] = current_node
+                    heapq.heappush(priority_queue, (distance + to_target[neighbor], distance, neighbor))
+        
+        return None, float('inf')
+    
+    def travel_time(self, slot: int, minute: float) -> float:
+        """Travel minutes on the CSR edge `slot` when entered at `minute` (of any day)"""
+        profile_id = self.profile_ids[slot]
+        if profile_id == -1:
+            return self.times[slot]
+        
+        lo = self.profile_offsets[profile_id]
+        hi = self.profile_offsets[profile_id + 1]
+        minutes, values = self.profile_minutes, self.profile_values
+        minute %= 1440
+        
+        # Breakpoints on either side of minute, wrapping around midnight
+        right = bisect.bisect_right(minutes, minute, lo, hi)
+        if right == lo:
+            t1, v1 = minutes[hi - 1] - 1440, values[hi - 1]
+            t2, v2 = minutes[lo], values[lo]
+        elif right == hi:
+            t1, v1 = minutes[hi - 1], values[hi - 1]
+            t2, v2 = minutes[lo] + 1440, values[lo]
+        else:
+            t1, v1 = minutes[right - 1], values[right - 1]
+            t2, v2 = minutes[right], values[right]
+        
+        if t2 == t1:
+            return v1
+        return v1 + (v2 - v1) * (minute - t1) / (t2 - t1)
+    
+    def time_dependent_path(self, start: int, end: int, departure: datetime,
+                            algorithm: str = "dijkstra") -> tuple:
+        """Earliest-arrival route leaving at `departure`; returns (path, travel minutes)"""
+        if algorithm not in ("dijkstra", "astar"):
+            raise ValueError(f"Unknown time-dependent algorithm: {algorithm}")
+        if not self.frozen:
+            self.freeze()
+        
+        source = self.node_index[start]
+        target = self.node_index[end]
+        offsets, targets = self.offsets, self.targets
+        xs, ys = self.xs, self.ys
+        scale = self.time_heuristic_scale if algorithm == "astar" else 0.0
+        target_x, target_y = xs[target], ys[target]
+        
+        # Labels are arrival minutes; A* adds a fastest-possible-speed lower bound
+        departure_minute = departure.hour * 60 + departure.minute + departure.second / 60
+        arrivals = [float('inf')] * len(self.node_ids)
+        previous_nodes = [-1] * len(self.node_ids)
+        arrivals[source] = departure_minute
+        settled = 0
+        
+        priority_queue = [(departure_minute, departure_minute, source)]
+        
+        while priority_queue:
+            _, current_arrival, current_node = heapq.heappop(priority_queue)
+            
+            if current_arrival > arrivals[current_node]:
+                continue
+            
+            settled += 1
+            if current_node == target:
+                break
+                
+            for slot in range(offsets[current_node], offsets[current_node + 1]):
+                neighbor = targets[slot]
+                arrival = current_arrival + self.travel_time(slot, current_arrival)
+                if arrival < arrivals[neighbor]:
+                    arrivals[neighbor] = arrival
+                    previous_nodes[neighbor] = current_node
+                    estimate = arrival
+                    if scale:
+                        estimate += scale * math.hypot(xs[neighbor] - target_x, ys[neighbor] - target_y)
+                    heapq.heappush(priority_queue, (estimate, arrival, neighbor))
+        
+        self.last_settled = settled
+        return self.unpack_path(previous_nodes, target), arrivals[target] - departure_minute
+    
+    def departure_path(self, start: int, end: int, departure: datetime,
+                       algorithm: str = "dijkstra") -> tuple:
+        """Route leaving at `departure`: the static route unless travel-time profiles could change it"""
+        path, distance = self.shortest_path(start, end, algorithm)
+        # Every route takes at least its weight; a static route that never
+        # touches a profiled edge and runs at free flow is already earliest-arrival
+        if distance == float('inf') or (self.free_flow_fastest and all(
+                self.edges[u][v]["profile"] is None and self.edges[u][v]["time"] == self.edges[u][v]["weight"]
+                for u, v in zip(path, path[1:]))):
+            return path, distance
+        return self.time_dependent_path(start, end, departure, "astar" if algorithm == "astar" else "dijkstra")
+    
+    def quote(self, start: int, end: int, departure: Optional[datetime] = None) -> tuple:
+        """(path, whole minutes, km) for a ride, as bookings price it; minutes is inf if unreachable"""
+        # Find optimal path (Dijkstra by default, see ROUTING_ALGORITHM),
+        # or read it straight from the all-pairs table when precomputed
+        algorithm = "table" if self.route_table else ROUTING_ALGORITHM
+        if departure is not None:
+            # Time-dependent only where rush-hour profiles lie on or could beat the static route
+            path, total_time = self.departure_path(start, end, departure, algorithm)
+        else:
+            path, total_time = self.shortest_path(start, end, algorithm)
+        if total_time == float('inf'):
+            return path, total_time, None
+        
+        # Calculate distance from free-flow weights (simplified)
+        free_flow = sum(self.edges[u][v]["weight"] for u, v in zip(path, path[1:]))
+        return path, math.ceil(total_time), free_flow * 0.5  # approx 0.5 km per minute
+    
+    def distance_matrix(self, sources: List[int], targets: List[int],
+                        processes: Optional[int] = None) -> np.ndarray:
+        """Travel costs from every source to every target as a dense matrix (inf if unreachable)"""
+        if not self.frozen:
+            self.freeze()
+        
+        # One one-to-many search per source row, optionally spread over a process pool
+        
+        source_indices = [self.node_index[node_id] for node_id in sources]
+        target_indices = [self.node_index[node_id] for node_id in targets]
+        matrix = np.full((len(sources), len(targets)), np.inf)
+        
+        if processes and processes > 1 and len(sources) > 1:
+            with ProcessPoolExecutor(
+                max_workers=processes,
+                initializer=_init_matrix_worker,
+                initargs=(self.offsets, self.targets, self.weights, target_indices)
+            ) as pool:
+                chunksize = max(1, len(source_indices) // (processes * 4))
+                rows = pool.map(_matrix_worker_row, source_indices, chunksize=chunksize)
+                for i, row in enumerate(rows):
+                    matrix[i] = row
+        else:
+            for i, source in enumerate(source_indices):
+                matrix[i] = one_to_many(self.offsets, self.targets, self.weights, source, target_indices)
+        
+        return matrix
+    
+    def table_lookup(self, start: int, end: int) -> tuple:
+        """Read the route from the all-pairs table, precomputing it first if needed"""
+        if not self.frozen or self.route_table is None or self.route_table.version != self.version:
+            self.precompute_routes()
+        self.last_settled = 0
+        return self.route_table.route(start, end)
+    
+    def contracted(self, start: int, end: int) -> tuple:
+        """Query the contraction hierarchy, building it first if needed"""
+        if not self.frozen or self.hierarchy is None:
+            self.build_hierarchy()
+        path, distance, self.last_settled = self.hierarchy.query(start, end)
+        return path, distance
+
+def one_to_many(offsets: array, targets: array, weights: array,
+                source: int, wanted: List[int]) -> List[float]:
+    """Dijkstra from one CSR index until every wanted index is settled"""
+    distances = {source: 0}
+    remaining = set(wanted)
+    priority_queue = [(0, source)]
+    
+    while priority_queue and remaining:
+        current_distance, current_node = heapq.heappop(priority_queue)
+        if current_distance > distances[current_node]:
+            continue
+        
+        remaining.discard(current_node)
+        for slot in range(offsets[current_node], offsets[current_node + 1]):
+            neighbor = targets[slot]
+            distance = current_distance + weights[slot]
+            if distance < distances.get(neighbor, float('inf')):
+                distances[neighbor] = distance
+                heapq.heappush(priority_queue, (distance, neighbor))
+    
+    return [distances.get(target, float('inf')) for target in wanted]
+
+def shortest_path_tree(offsets: array, targets: array, weights: array, source: int) -> tuple:
+    """Full Dijkstra from one CSR index, returning (distances, predecessors)"""
+    n = len(offsets) - 1
+    distances = [float('inf')] * n
+    previous_nodes = [-1] * n
+    distances[source] = 0
+    priority_queue = [(0, source)]
+    
+    while priority_queue:
+        current_distance, current_node = heapq.heappop(priority_queue)
+        if current_distance > distances[current_node]:
+            continue
+        
+        for slot in range(offsets[current_node], offsets[current_node + 1]):
+            neighbor = targets[slot]
+            distance = current_distance + weights[slot]
+            if distance < distances[neighbor]:
+                distances[neighbor] = distance
+                previous_nodes[neighbor] = current_node
+                heapq.heappush(priority_queue, (distance, neighbor))
+    
+    return distances, previous_nodes
+
+# Process-pool workers for distance_matrix (the CSR arrays are shipped once per worker)
+_matrix_worker_state = {}
+
+def _init_matrix_worker(offsets: array, targets: array, weights: array, wanted: List[int]):
+    _matrix_worker_state.update(offsets=offsets, targets=targets, weights=weights, wanted=wanted)
+
+def _matrix_worker_row(source: int) -> List[float]:
+    state = _matrix_worker_state
+    return one_to_many(state["offsets"], state["targets"], state["weights"], source, state["wanted"])
+
+class RouteTable:
+    """All-pairs distances and predecessors stored as flat row-major arrays"""
+    
+    def __init__(self, node_ids: list, fingerprint: str, distances: array, predecessors: array):
+        self.node_ids = node_ids
+        self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.fingerprint = fingerprint
+        self.distances = distances
+        self.predecessors = predecessors
+        # Graph version the table reflects, set by TransportationGraph
+        self.version = None
+    
+    @classmethod
+    def build(cls, graph: TransportationGraph) -> "RouteTable":
+        n = len(graph.node_ids)
+        distances = array("d")
+        predecessors = array("i")
+        for source in range(n):
+            row_distances, row_previous = shortest_path_tree(graph.offsets, graph.targets, graph.weights, source)
+            distances.extend(row_distances)
+            predecessors.extend(row_previous)
+        return cls(list(graph.node_ids), graph.fingerprint(), distances, predecessors)
+    
+    @classmethod
+    def load_or_build(cls, graph: TransportationGraph, cache_dir: Optional[str] = None) -> "RouteTable":
+        """Reuse a cached table for this graph's fingerprint, otherwise build and cache it"""
+        fingerprint = graph.fingerprint()
+        path = None
+        if cache_dir:
+            path = os.path.join(cache_dir, f"routes-{fingerprint[:16]}.pkl")
+            try:
+                table = cls.load(path)
+                if table.fingerprint == fingerprint:
+                    return table
+            except (OSError, pickle.UnpicklingError, EOFError, KeyError):
+                pass
+        
+        table = cls.build(graph)
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            table.save(path)
+        return table
+    
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump({
+                "node_ids": self.node_ids,
+                "fingerprint": self.fingerprint,
+                "distances": self.distances,
+                "predecessors": self.predecessors
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    @classmethod
+    def load(cls, path: str) -> "RouteTable":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["node_ids"], data["fingerprint"], data["distances"], data["predecessors"])
+    
+    def repair(self, graph: TransportationGraph, u: int, v: int, old_weight: float, new_weight: float):
+        """Update rows after the weight of edge u->v (node indices) changed"""
+        n = len(self.node_ids)
+        if new_weight < old_weight:
+            # Cheaper edge: only rows where it now improves v need a local relaxation
+            for source in range(n):
+                self.propagate_decrease(graph, source * n, u, v, new_weight)
+        else:
+            # Dearer or closed edge: only rows whose tree uses it are affected
+            for source in range(n):
+                if self.predecessors[source * n + v] == u:
+                    self.rebuild_subtree(graph, source * n, v)
+        
+        self.fingerprint = graph.fingerprint()
+        self.version = graph.version
+    
+    def propagate_decrease(self, graph: TransportationGraph, row: int, u: int, v: int, weight: float):
+        distances, predecessors = self.distances, self.predecessors
+        candidate = distances[row + u] + weight
+        if candidate >= distances[row + v]:
+            return
+        
+        distances[row + v] = candidate
+        predecessors[row + v] = u
+        priority_queue = [(candidate, v)]
+        while priority_queue:
+            current_distance, current_node = heapq.heappop(priority_queue)
+            if current_distance > distances[row + current_node]:
+                continue
+            for slot in range(graph.offsets[current_node], graph.offsets[current_node + 1]):
+                neighbor = graph.targets[slot]
+                distance = current_distance + graph.weights[slot]
+                if distance < distances[row + neighbor]:
+                    distances[row + neighbor] = distance
+                    predecessors[row + neighbor] = current_node
+                    heapq.heappush(priority_queue, (distance, neighbor))
+    
+    def rebuild_subtree(self, graph: TransportationGraph, row: int, root: int):
+        """Recompute the part of one shortest-path tree hanging below root"""
+        n = len(self.node_ids)
+        distances, predecessors = self.distances, self.predecessors
+        children = [[] for _ in range(n)]
+        for node in range(n):
+            parent = predecessors[row + node]
+            if parent != -1:
+                children[parent].append(node)
+        
+        subtree = [root]
+        for node in subtree:
+            subtree.extend(children[node])
+        affected = set(subtree)
+        for node in subtree:
+            distances[row + node] = float('inf')
+            predecessors[row + node] = -1
+        
+        # Seed each affected node from its best unaffected in-neighbour
+        priority_queue = []
+        for node in subtree:
+            for slot in range(graph.reverse_offsets[node], graph.reverse_offsets[node + 1]):
+                neighbor = graph.reverse_targets[slot]
+                if neighbor in affected:
+                    continue
+                distance = distances[row + neighbor] + graph.reverse_weights[slot]
+                if distance < distances[row + node]:
+                    distances[row + node] = distance
+                    predecessors[row + node] = neighbor
+            if distances[row + node] < float('inf'):
+                priority_queue.append((distances[row + node], node))
+        heapq.heapify(priority_queue)
+        
+        while priority_queue:
+            current_distance, current_node = heapq.heappop(priority_queue)
+            if current_distance > distances[row + current_node]:
+                continue
+            for slot in range(graph.offsets[current_node], graph.offsets[current_node + 1]):
+                neighbor = graph.targets[slot]
+                distance = current_distance + graph.weights[slot]
+                if neighbor in affected and distance < distances[row + neighbor]:
+                    distances[row + neighbor] = distance
+                    predecessors[row + neighbor] = current_node
+                    heapq.heappush(priority_queue, (distance, neighbor))
+    
+    def route(self, start: int, end: int) -> tuple:
+        """Return (path, distance) by walking the predecessor row of start"""
+        n = len(self.node_ids)
+        source = self.node_index[start]
+        target = self.node_index[end]
+        row = source * n
+        distance = self.distances[row + target]
+        if distance == float('inf'):
+            return [end], distance
+        
+        path = []
+        current = target
+        while current != -1:
+            path.append(self.node_ids[current])
+            current = self.predecessors[row + current]
+        path.reverse()
+        return path, distance
+
+class ContractionHierarchy:
+    """Shortcut-augmented upward graphs built by contracting nodes in importance order"""
+    
+    WITNESS_SETTLE_LIMIT = 200
+    
+    def __init__(self, node_ids: list, fingerprint: str, rank: array,
+                 up: tuple, down: tuple, middles: dict):
+        self.node_ids = node_ids
+        self.node_index = {node_id: i for i, node_id in enumerate(node_ids)}
+        self.fingerprint = fingerprint
+        self.rank = rank
+        # (offsets, targets, weights) CSR arrays of edges towards higher rank;
+        # `down` is stored reversed so the backward search also climbs
+        self.up = up
+        self.down = down
+        # Shortcut (u, v) -> contracted middle node, for path unpacking
+        self.middles = middles
+    
+    @classmethod
+    def build(cls, graph: TransportationGraph) -> "ContractionHierarchy":
+        n = len(graph.node_ids)
+        out_edges = [{} for _ in range(n)]
+        in_edges = [{} for _ in range(n)]
+        for source in range(n):
+            for slot in range(graph.offsets[source], graph.offsets[source + 1]):
+                target = graph.targets[slot]
+                # Closed roads stay in the CSR arrays as infinite-weight tombstones
+                if target != source and graph.weights[slot] < float('inf'):
+                    out_edges[source][target] = graph.weights[slot]
+                    in_edges[target][source] = graph.weights[slot]
+        
+        middles = {}
+        contracted = [False] * n
+        deleted_neighbors = [0] * n
+        
+        def witness_distances(source, excluded, limit):
+            distances = {source: 0}
+            queue = [(0, source)]
+            settled = 0
+            while queue and settled < cls.WITNESS_SETTLE_LIMIT:
+                distance, node = heapq.heappop(queue)
+                if distance > distances[node] or distance > limit:
+                    continue
+                settled += 1
+                for neighbor, weight in out_edges[node].items():
+                    if neighbor == excluded or contracted[neighbor]:
+                        continue
+                    candidate = distance + weight
+                    if candidate < distances.get(neighbor, float('inf')):
+                        distances[neighbor] = candidate
+                        heapq.heappush(queue, (candidate, neighbor))
+            return distances
+        
+        def needed_shortcuts(node):
+            shortcuts = []
+            outgoing = [(v, w) for v, w in out_edges[node].items() if not contracted[v]]
+            if not outgoing:
+                return shortcuts
+            max_out = max(w for _, w in outgoing)
+            for u, weight_in in in_edges[node].items():
+                if contracted[u]:
+                    continue
+                distances = witness_distances(u, node, weight_in + max_out)
+                for v, weight_out in outgoing:
+                    if v == u:
+                        continue
+                    via = weight_in + weight_out
+                    if distances.get(v, float('inf')) > via:
+                        shortcuts.append((u, v, via))
+            return shortcuts
+        
+        def priority(node):
+            degree = sum(1 for v in out_edges[node] if not contracted[v]) + \
+                sum(1 for u in in_edges[node] if not contracted[u])
+            return len(needed_shortcuts(node)) - degree + deleted_neighbors[node]
+        
+        queue = [(priority(node), node) for node in range(n)]
+        heapq.heapify(queue)
+        rank = array("q", [0] * n)
+        next_rank = 0
+        
+        while queue:
+            _, node = heapq.heappop(queue)
+            # Lazy update: re-evaluate and requeue if no longer the minimum
+            current = priority(node)
+            if queue and current > queue[0][0]:
+                heapq.heappush(queue, (current, node))
+                continue
+            
+            for u, v, weight in needed_shortcuts(node):
+                if weight < out_edges[u].get(v, float('inf')):
+                    out_edges[u][v] = weight
+                    in_edges[v][u] = weight
+                    middles[(u, v)] = node
+            
+            contracted[node] = True
+            rank[node] = next_rank
+            next_rank += 1
+            for neighbor in set(out_edges[node]) | set(in_edges[node]):
+                deleted_neighbors[neighbor] += 1
+        
+        # Keep only upward edges: forward search follows u->v with rank[v] > rank[u],
+        # backward search follows reversed u->v with rank[u] > rank[v]
+        up_lists = [[] for _ in range(n)]
+        down_lists = [[] for _ in range(n)]
+        for u in range(n):
+            for v, weight in out_edges[u].items():
+                if rank[v] > rank[u]:
+                    up_lists[u].append((v, weight))
+                else:
+                    down_lists[v].append((u, weight))
+        
+        middles = {edge: middle for edge, middle in middles.items()
+                   if out_edges[edge[0]].get(edge[1]) is not None}
+        return cls(list(graph.node_ids), graph.fingerprint(), rank,
+                   cls._pack(up_lists), cls._pack(down_lists), middles)
+    
+    @staticmethod
+    def _pack(adjacency: list) -> tuple:
+        offsets = array("q", [0])
+        targets = array("q")
+        weights = array("d")
+        for neighbors in adjacency:
+            for target, weight in neighbors:
+                targets.append(target)
+                weights.append(weight)
+            offsets.append(len(targets))
+        return offsets, targets, weights
+    
+    def save(self, path: str):
+        with open(path, "wb") as f:
+            pickle.dump({
+                "node_ids": self.node_ids,
+                "fingerprint": self.fingerprint,
+                "rank": self.rank,
+                "up": self.up,
+                "down": self.down,
+                "middles": self.middles
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+    
+    @classmethod
+    def load(cls, path: str) -> "ContractionHierarchy":
+        with open(path, "rb") as f:
+            data = pickle.load(f)
+        return cls(data["node_ids"], data["fingerprint"], data["rank"],
+                   data["up"], data["down"], data["middles"])
+    
+    def query(self, start: int, end: int) -> tuple:
+        """Return (path, distance, settled) using bidirectional upward search"""
+        source = self.node_index[start]
+        target = self.node_index[end]
+        
+        distances = ({source: 0}, {target: 0})
+        parents = ({source: -1}, {target: -1})
+        queues = ([(0, source)], [(0, target)])
+        best = float('inf')
+        meeting_node = -1
+        settled = 0
+        
+        while (queues[0] and queues[0][0][0] < best) or (queues[1] and queues[1][0][0] < best):
+            for side in (0, 1):
+                queue = queues[side]
+                if not queue or queue[0][0] >= best:
+                    continue
+                
+                offsets, targets, weights = self.up if side == 0 else self.down
+                own_distances, other_distances = distances[side], distances[1 - side]
+                current_distance, current_node = heapq.heappop(queue)
+                if current_distance > own_distances[current_node]:
+                    continue
+                
+                settled += 1
+                if current_node in other_distances:
+                    total = current_distance + other_distances[current_node]
+                    if total < best:
+                        best = total
+                        meeting_node = current_node
+                
+                for slot in range(offsets[current_node], offsets[current_node + 1]):
+                    neighbor = targets[slot]
+                    distance = current_distance + weights[slot]
+                    if distance < own_distances.get(neighbor, float('inf')):
+                        own_distances[neighbor] = distance
+                        parents[side][neighbor] = current_node
+                        heapq.heappush(queue, (distance, neighbor))
+        
+        if meeting_node == -1:
+            return [end], float('inf'), settled
+        
+        # Hierarchy edges along the search trees, in travel order
+        chain = []
+        current = meeting_node
+        while current != -1:
+            chain.append(current)
+            current = parents[0][current]
+        chain.reverse()
+        current = parents[1][meeting_node]
+        while current != -1:
+            chain.append(current)
+            current = parents[1][current]
+        
+        path = [chain[0]]
+        for u, v in zip(chain, chain[1:]):
+            self._unpack_edge(u, v, path)
+        return [self.node_ids[node] for node in path], best, settled
+    
+    def _unpack_edge(self, u: int, v: int, path: list):
+        """Append the original nodes after u on the edge u->v, expanding shortcuts"""
+        stack = [(u, v)]
+        while stack:
+            a, b = stack.pop()
+            middle = self.middles.get((a, b))
+            if middle is None:
+                path.append(b)
+            else:
+                stack.append((middle, b))
+                stack.append((a, middle))
+
+# Routing provider client
+class RoutingProviderError(Exception):
+    """The routing provider could not be reached or kept failing"""
+
+class RoutingProviderClient:
+    """Directions API client with a pooled session, timeouts, retries and a circuit breaker"""
+    
+    RETRYABLE_HTTP = {429, 500, 502, 503, 504}
+    RETRYABLE_STATUS = {"OVER_QUERY_LIMIT", "UNKNOWN_ERROR"}
+    
+    def __init__(self, api_key: str, base_url: str = ROUTING_PROVIDER_URL,
+                 connect_timeout: float = ROUTING_CONNECT_TIMEOUT, read_timeout: float = ROUTING_READ_TIMEOUT,
+                 retries: int = ROUTING_RETRIES, backoff: float = 0.5, pool_size: int = 10,
+                 failure_threshold: int = 5, reset_after: float = 30.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self.failure_threshold = failure_threshold
+        self.reset_after = reset_after
+        
+        # Keep-alive connections are reused across rides
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.opened_at = None
+    
+    def available(self) -> bool:
+        """False while the circuit is open; half-open again after reset_after seconds"""
+        with self.lock:
+            if self.opened_at is None:
+                return True
+            return now_seconds() - self.opened_at >= self.reset_after
+    
+    def record_success(self):
+        with self.lock:
+            self.consecutive_failures = 0
+            self.opened_at = None
+    
+    def record_failure(self):
+        with self.lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                self.opened_at = now_seconds()
+    
+    def directions(self, origin: str, destination: str, departure: Optional[datetime] = None) -> dict:
+        """Return the decoded Directions response, raising RoutingProviderError on failure"""
+        if not self.available():
+            raise RoutingProviderError("circuit open")
+        
+        params = {
+            "origin": origin,
+            "destination": destination,
+            "key": self.api_key,
+            "mode": "driving"
+        }
+        
+        # Google only accounts for traffic on future departures
+        if departure and departure > datetime.now():
+            params["departure_time"] = int(departure.timestamp())
+        
+        last_error = "no attempt made"
+        for attempt in range(self.retries + 1):
+            if attempt:
+                sleep(self.backoff * 2 ** (attempt - 1) * random.uniform(0.5, 1.5))
+            try:
+                response = self.session.get(self.base_url, params=params, timeout=self.timeout)
+                if response.status_code in self.RETRYABLE_HTTP:
+                    last_error = f"HTTP {response.status_code}"
+                    continue
+                if 400 <= response.status_code < 500:
+                    # Our request is at fault (bad key, bad parameters): no retry, provider stays healthy
+                    raise RoutingProviderError(f"HTTP {response.status_code}")
+                response.raise_for_status()
+                data = response.json()
+            except (requests.RequestException, ValueError) as e:
+                last_error = str(e)
+                continue
+            
+            if data.get("status") in self.RETRYABLE_STATUS:
+                last_error = data["status"]
+                continue
+            
+            self.record_success()
+            return data
+        
+        self.record_failure()
+        raise RoutingProviderError(last_error)
+
+# In-flight request coalescing
+@dataclass
+class Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    result: object = None
+    error: Optional[BaseException] = None
+
+class SingleFlight:
+    """Concurrent calls with the same key share one execution and its result"""
+    
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.flights = {}
+        self.counters = {"calls": 0, "executions": 0, "coalesced": 0}
+    
+    def do(self, key: str, fn):
+        with self.lock:
+            self.counters["calls"] += 1
+            flight = self.flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self.flights[key] = Flight()
+                self.counters["executions"] += 1
+            else:
+                self.counters["coalesced"] += 1
+        
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        
+        try:
+            flight.result = fn()
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[key]
+            flight.done.set()
+        return flight.result
+    
+    def stats(self) -> dict:
+        with self.lock:
+            return dict(self.counters)
+
+# Shared by every session so riders requesting the same route coalesce
+route_flights = SingleFlight()
+
+# Route result cache
+class RouteCache:
+    """In-memory LRU tier in front of a SQLite tier, both with TTL expiry"""
+    
+    def __init__(self, path: Optional[str] = None, capacity: int = 1024,
+                 ttl: int = ROUTE_CACHE_TTL, bucket_minutes: int = 15):
+        self.capacity = capacity
+        self.ttl = ttl
+        self.bucket_minutes = bucket_minutes
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+        self.counters = {"memory_hits": 0, "disk_hits": 0, "misses": 0,
+                         "miss_seconds": 0.0, "api_hits": 0}
+        self.puts_since_purge = 0
+        
+        self.path = path
+        self.db = None
+    
+    def connection(self) -> Optional[sqlite3.Connection]:
+        """The one SQLite connection, opened on first use; callers hold self.lock"""
+        if self.db is None and self.path:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            # Other processes may share the file; wait for their writes instead of failing
+            self.db = sqlite3.connect(self.path, timeout=5.0, check_same_thread=False)
+            self.db.execute(
+                "CREATE TABLE IF NOT EXISTS route_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL)"
+            )
+            self.db.commit()
+        return self.db
+    
+    def key(self, origin: str, destination: str, mode: str, departure: Optional[datetime] = None) -> str:
+        """Normalized lookup key; departures share a key within the same time-of-day bucket"""
+        bucket = "any"
+        if departure is not None:
+            bucket = str((departure.hour * 60 + departure.minute) // self.bucket_minutes)
+        return "|".join((TransportationGraph.normalize_name(origin),
+                         TransportationGraph.normalize_name(destination), mode, bucket))
+    
+    def get(self, key: str) -> Optional[tuple]:
+        now = now_seconds()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if entry[1] > now:
+                    self.memory.move_to_end(key)
+                    self.counters["memory_hits"] += 1
+                    return entry[0]
+                del self.memory[key]
+            
+            if self.path:
+                try:
+                    row = self.connection().execute(
+                        "SELECT value, expires_at FROM route_cache WHERE key = ? AND expires_at > ?",
+                        (key, now)
+                    ).fetchone()
+                except sqlite3.Error as e:
+                    # The disk tier is only a cache; a locked or broken file counts as a miss
+                    print(f"❌ Route cache read failed: {e}")
+                    return None
+                if row:
+                    value = tuple(json.loads(row[0]))
+                    self.remember(key, value, row[1])
+                    self.counters["disk_hits"] += 1
+                    return value
+        return None
+    
+    def put(self, key: str, value: tuple):
+        expires_at = now_seconds() + self.ttl
+        with self.lock:
+            self.remember(key, value, expires_at)
+            if self.path:
+                try:
+                    db = self.connection()
+                    db.execute(
+                        "INSERT OR REPLACE INTO route_cache (key, value, expires_at) VALUES (?, ?, ?)",
+                        (key, json.dumps(value), expires_at)
+                    )
+                    self.puts_since_purge += 1
+                    if self.puts_since_purge >= 100:
+                        db.execute("DELETE FROM route_cache WHERE expires_at <= ?", (now_seconds(),))
+                        self.puts_since_purge = 0
+                    db.commit()
+                except sqlite3.Error as e:
+                    # The memory tier still has the route; the next put retries the file
+                    print(f"❌ Route cache write failed: {e}")
+                    if self.db is not None:
+                        self.db.rollback()
+    
+    def remember(self, key: str, value: tuple, expires_at: float):
+        self.memory[key] = (value, expires_at)
+        self.memory.move_to_end(key)
+        while len(self.memory) > self.capacity:
+            self.memory.popitem(last=False)
+    
+    def get_or_compute(self, key: str, compute, api: bool = False) -> tuple:
+        """Cached route for key, else compute() it and cache successful results"""
+        cached = self.get(key)
+        if cached is not None:
+            if api:
+                with self.lock:
+                    self.counters["api_hits"] += 1
+            return cached
+        
+        started = perf_counter()
+        result = compute()
+        with self.lock:
+            self.counters["misses"] += 1
+            self.counters["miss_seconds"] += perf_counter() - started
+        if result[0] is not None:
+            self.put(key, result)
+        return result
+    
+    def stats(self) -> dict:
+        """Hit/miss counters plus the latency and API calls the hits avoided"""
+        with self.lock:
+            stats = dict(self.counters)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        average_miss = stats["miss_seconds"] / stats["misses"] if stats["misses"] else 0.0
+        stats["hit_rate"] = hits / (hits + stats["misses"]) if hits + stats["misses"] else 0.0
+        stats["avoided_seconds"] = hits * average_miss
+        stats["avoided_api_calls"] = stats.pop("api_hits")
+        return stats
+
+# Shared by every session so the LRU tier serves all riders and one connection writes the file
+route_cache = RouteCache(ROUTE_CACHE_PATH)
+
+# Driver capability index
+class DriverCapabilityIndex:
+    """In-process cache of available drivers as feature -> usernames sets, backed by Mongo indexes"""
+    
+    def __init__(self, refresh_after: float = 30.0):
+        self.refresh_after = refresh_after
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.available = set()
+        self.by_feature = {}
+        self.order = {}
+    
+    @staticmethod
+    def ensure_indexes():
+        """Create the multikey capability index and backfill vehicle_features"""
+        drivers_collection.create_index([("availability", 1), ("vehicle_features", 1)])
+        for driver_data in drivers_collection.find({"vehicle_features": {"$exists": False}},
+                                                   {"vehicle_type": 1}):
+            drivers_collection.update_one(
+                {"_id": driver_data["_id"]},
+                {"$set": {"vehicle_features": vehicle_features_for(driver_data.get("vehicle_type", ""))}}
+            )
+    
+    def refresh(self):
+        """Reload available drivers with one indexed, projected query"""
+        available = set()
+        by_feature = {}
+        order = {}
+        cursor = drivers_collection.find({"availability": True},
+                                         {"username": 1, "vehicle_type": 1, "vehicle_features": 1})
+        for position, driver_data in enumerate(cursor):
+            username = driver_data["username"]
+            features = driver_data.get("vehicle_features") or vehicle_features_for(driver_data.get("vehicle_type", ""))
+            available.add(username)
+            order.setdefault(username, position)
+            for feature in features:
+                by_feature.setdefault(feature, set()).add(username)
+        
+        with self.lock:
+            self.available = available
+            self.by_feature = by_feature
+            self.order = order
+            self.loaded_at = now_seconds()
+    
+    def candidates(self, features: List[str]) -> set:
+        """Available drivers having every feature (set intersection)"""
+        if self.loaded_at is None or now_seconds() - self.loaded_at > self.refresh_after:
+            self.refresh()
+        with self.lock:
+            sets = [self.available] + [self.by_feature.get(feature, set()) for feature in features]
+            sets.sort(key=len)
+            return set.intersection(*sets)
+    
+    def match(self, ride_request: RideRequest, graph: Optional[TransportationGraph] = None,
+              nearest: int = NEAREST_DRIVERS) -> Optional[str]:
+        """Capable driver free for the whole trip, closest first when positions are known; books the window"""
+        candidates = self.candidates(required_features(ride_request.accessibility_requirements))
+        ranked = sorted(candidates, key=lambda username: self.order.get(username, 0))
+        
+        # Only the k nearest are routed exactly; the rest follow in collection order
+        pickup = graph.find_location(ride_request.pickup) if graph is not None else None
+        if pickup is not None and candidates:
+            closest = driver_locator.nearest_by_route(graph, pickup, nearest, candidates)
+            routed = set(closest)
+            ranked = closest + [username for username in ranked if username not in routed]
+        
+        start, end = ride_window(ride_request)
+        for username in ranked:
+            if driver_schedule.try_book(username, start, end):
+                return username
+        return None
+
+# Shared by every session; refreshed from Mongo every refresh_after seconds
+driver_capabilities = DriverCapabilityIndex()
+
+# Driver positions
+EARTH_RADIUS_KM = 6371.0
+
+def haversine_km(a: Tuple[float, float], b: Tuple[float, float]) -> float:
+    """Great-circle distance between two (longitude, latitude) points"""
+    lon1, lat1, lon2, lat2 = map(math.radians, (a[0], a[1], b[0], b[1]))
+    h = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(h)))
+
+class DriverLocator:
+    """Grid buckets of live driver positions for k-nearest queries with O(1) moves"""
+    
+    def __init__(self, cell_degrees: float = 0.01, refresh_after: float = 30.0):
+        self.cell = cell_degrees  # ~1 km of latitude
+        self.refresh_after = refresh_after
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.positions = {}
+        self.buckets = {}
+    
+    @staticmethod
+    def ensure_indexes():
+        """2dsphere index so Mongo can answer $near on driver positions too"""
+        drivers_collection.create_index([("position", "2dsphere")])
+    
+    def bucket(self, position: Tuple[float, float]) -> tuple:
+        return math.floor(position[0] / self.cell), math.floor(position[1] / self.cell)
+    
+    def refresh(self):
+        """Reload positions of available drivers"""
+        positions = {}
+        for driver_data in drivers_collection.find({"availability": True, "position": {"$ne": None}},
+                                                   {"username": 1, "position": 1}):
+            positions[driver_data["username"]] = tuple(driver_data["position"]["coordinates"])
+        buckets = {}
+        for username, position in positions.items():
+            buckets.setdefault(self.bucket(position), set()).add(username)
+        
+        with self.lock:
+            self.positions = positions
+            self.buckets = buckets
+            self.loaded_at = now_seconds()
+    
+    def ensure_loaded(self):
+        if self.loaded_at is None or now_seconds() - self.loaded_at > self.refresh_after:
+            self.refresh()
+    
+    def move(self, username: str, position: Optional[Tuple[float, float]]):
+        """Move (or with None, remove) one driver in the in-memory index"""
+        with self.lock:
+            old = self.positions.pop(username, None)
+            if old is not None:
+                self.buckets.get(self.bucket(old), set()).discard(username)
+            if position is not None:
+                self.positions[username] = position
+                self.buckets.setdefault(self.bucket(position), set()).add(username)
+    
+    def update_position(self, username: str, position: Tuple[float, float], location: Optional[str] = None):
+        """Record a driver's live position in Mongo and the index"""
+        changes = {"position": {"type": "Point", "coordinates": list(position)}}
+        if location is not None:
+            changes["current_location"] = location
+        drivers_collection.update_one({"username": username}, {"$set": changes})
+        self.move(username, position)
+    
+    def nearest(self, position: Tuple[float, float], k: int, allowed: Optional[set] = None) -> List[tuple]:
+        """Up to k (km, username) pairs closest to position, searching rings of buckets outward"""
+        self.ensure_loaded()
+        center_x, center_y = self.bucket(position)
+        found = []
+        with self.lock:
+            if allowed is None:
+                candidates = len(self.positions)
+            else:
+                candidates = sum(1 for username in allowed if username in self.positions)
+            if not candidates:
+                return []
+            
+            # Only rings overlapping the occupied buckets can hold drivers
+            min_x = min(x for x, _ in self.buckets)
+            max_x = max(x for x, _ in self.buckets)
+            min_y = min(y for _, y in self.buckets)
+            max_y = max(y for _, y in self.buckets)
+            ring = max(0, min_x - center_x, center_x - max_x, min_y - center_y, center_y - max_y)
+            last_ring = max(center_x - min_x, max_x - center_x, center_y - min_y, max_y - center_y)
+            while ring <= last_ring and len(found) < candidates:
+                # Drivers from this ring outward are more than ring - 1 cells away on one axis
+                if len(found) >= k and ring > 1:
+                    latitude = min(89.9, abs(position[1]) + (ring + 1) * self.cell)
+                    bound = (ring - 1) * self.cell * math.radians(EARTH_RADIUS_KM) * math.cos(math.radians(latitude))
+                    if bound > found[k - 1][0]:
+                        break
+                # Sparse or far-off drivers: checking each one is cheaper than the remaining rings
+                if (2 * ring + 1) ** 2 > len(self.positions):
+                    found = [(haversine_km(position, coords), username) for username, coords in self.positions.items()
+                             if allowed is None or username in allowed]
+                    found.sort()
+                    break
+                for x in range(max(center_x - ring, min_x), min(center_x + ring, max_x) + 1):
+                    if abs(x - center_x) == ring:
+                        column = range(max(center_y - ring, min_y), min(center_y + ring, max_y) + 1)
+                    else:
+                        column = {center_y - ring, center_y + ring}
+                    for y in column:
+                        for username in self.buckets.get((x, y), ()):
+                            if allowed is None or username in allowed:
+                                found.append((haversine_km(position, self.positions[username]), username))
+                found.sort()
+                ring += 1
+        return found[:k]
+    
+    def nearest_by_route(self, graph: TransportationGraph, pickup: int, k: int,
+                         allowed: Optional[set] = None) -> List[str]:
+        """The k straight-line nearest drivers, re-ranked by exact route minutes to the pickup"""
+        coords = graph.nodes[pickup]["coords"]
+        if coords is None:
+            return []
+        nearest = self.nearest(coords, k, allowed)
+        starts = {username: graph.nearest_node(self.positions[username]) for _, username in nearest
+                  if username in self.positions}
+        sources = sorted({node for node in starts.values() if node is not None})
+        if not sources:
+            return [username for _, username in nearest]
+        minutes = dict(zip(sources, graph.distance_matrix(sources, [pickup])[:, 0]))
+        return sorted((username for _, username in nearest),
+                      key=lambda username: minutes.get(starts.get(username), math.inf))
+
+# Shared by every session; moves are applied in place, full reloads every refresh_after seconds
+driver_locator = DriverLocator()
+
+# Driver time windows
+TURNAROUND_MINUTES = 10  # buffer after each trip before the next pickup
+
+def ride_window(ride_request: RideRequest) -> tuple:
+    """(start, end) POSIX seconds a ride keeps its driver busy"""
+    start = ride_request.scheduled_time.timestamp()
+    minutes = (ride_request.estimated_time or 0) + TURNAROUND_MINUTES
+    return start, start + minutes * 60
+
+class DriverSchedule:
+    """Per-driver booked windows as sorted, merged start/end arrays for O(log n) free checks"""
+    
+    def __init__(self, refresh_after: float = 30.0):
+        self.refresh_after = refresh_after
+        self.lock = threading.Lock()
+        self.loaded_at = None
+        self.starts = {}
+        self.ends = {}
+    
+    def refresh(self):
+        """Rebuild from upcoming scheduled/in-progress rides with one projected query"""
+        windows = {}
+        cursor = rides_collection.find(
+            {"status": {"$in": ["scheduled", "in_progress"]},
+             "driver_id": {"$ne": None},
+             "scheduled_time": {"$gte": datetime.now() - timedelta(days=1)}},
+            {"driver_id": 1, "scheduled_time": 1, "estimated_time": 1}
+        )
+        for ride_data in cursor:
+            ride_request = RideRequest.from_dict({"user_id": "", "pickup": "", "dropoff": "", **ride_data})
+            windows.setdefault(ride_data["driver_id"], []).append(ride_window(ride_request))
+        
+        starts, ends = {}, {}
+        for username, intervals in windows.items():
+            starts[username], ends[username] = [], []
+            for start, end in sorted(intervals):
+                self.merge(starts[username], ends[username], start, end)
+        
+        with self.lock:
+            self.starts = starts
+            self.ends = ends
+            self.loaded_at = now_seconds()
+    
+    def ensure_loaded(self):
+        if self.loaded_at is None or now_seconds() - self.loaded_at > self.refresh_after:
+            self.refresh()
+    
+    @staticmethod
+    def merge(starts: list, ends: list, start: float, end: float):
+        """Insert [start, end) keeping the windows sorted and non-overlapping"""
+        i = bisect.bisect_left(ends, start)
+        j = bisect.bisect_right(starts, end)
+        if i < j:
+            start = min(start, starts[i])
+            end = max(end, ends[j - 1])
+        starts[i:j] = [start]
+        ends[i:j] = [end]
+    
+    def is_free(self, username: str, start: float, end: float) -> bool:
+        self.ensure_loaded()
+        with self.lock:
+            return self.free_locked(username, start, end)
+    
+    def free_locked(self, username: str, start: float, end: float) -> bool:
+        starts = self.starts.get(username, [])
+        # The last window starting before `end` is the only one that can overlap
+        i = bisect.bisect_left(starts, end)
+        return i == 0 or self.ends[username][i - 1] <= start
+    
+    def try_book(self, username: str, start: float, end: float) -> bool:
+        """Atomically book [start, end) if the driver is free for all of it"""
+        self.ensure_loaded()
+        with self.lock:
+            if not self.free_locked(username, start, end):
+                return False
+            self.merge(self.starts.setdefault(username, []), self.ends.setdefault(username, []), start, end)
+            return True
+    
+    def busy_matrix(self, usernames: List[str], windows: List[tuple]) -> np.ndarray:
+        """busy[i, j] is True when driver i already has a booking overlapping window j"""
+        self.ensure_loaded()
+        ride_starts = np.array([start for start, _ in windows], dtype=float)
+        ride_ends = np.array([end for _, end in windows], dtype=float)
+        busy = np.zeros((len(usernames), len(windows)), dtype=bool)
+        with self.lock:
+            for i, username in enumerate(usernames):
+                if not self.starts.get(username):
+                    continue
+                starts = np.array(self.starts[username])
+                ends = np.array(self.ends[username])
+                k = np.searchsorted(starts, ride_ends, side="left")
+                busy[i] = (k > 0) & (ends[np.maximum(k - 1, 0)] > ride_starts)
+        return busy
+
+# Shared by every session so concurrent bookings can't overbook a driver
+driver_schedule = DriverSchedule()
+
+# Shared rides
+@dataclass
+class RidePool:
+    """Rides sharing one vehicle and the stop sequence that serves them"""
+    rides: List[int]        # indices into the planned ride list
+    stops: List[tuple]      # (ride index, "pickup" | "dropoff", node) in visiting order
+    start: datetime
+    minutes: float          # first pickup to last dropoff, including waits
+    peak: int               # most passengers on board at once
+    
+    def as_ride(self, rides: List[RideRequest]) -> RideRequest:
+        """The whole pool as one trip, so the dispatcher can assign it like a single ride"""
+        members = [rides[i] for i in self.rides]
+        drivers = {ride.driver_id for ride in members}
+        return RideRequest(
+            user_id="",
+            pickup=rides[self.stops[0][0]].pickup,
+            dropoff=rides[self.stops[-1][0]].dropoff,
+            scheduled_time=self.start,
+            accessibility_requirements=sorted({req for ride in members for req in ride.accessibility_requirements}),
+            driver_id=drivers.pop() if len(drivers) == 1 else None,
+            estimated_time=math.ceil(self.minutes),
+            passengers=self.peak
+        )
+
+class PoolingEngine:
+    """Groups rides with overlapping windows and small detours into capacity-limited multi-stop trips"""
+    
+    def __init__(self, graph: TransportationGraph, window_minutes: float = 15,
+                 max_detour: float = 0.5, min_detour_minutes: float = 5, max_rows: int = 2048):
+        self.graph = graph
+        # How late a pooled pickup may be, and how far apart pooled rides' times may be
+        self.window = window_minutes
+        # Extra in-vehicle time a rider accepts, relative to riding alone
+        self.max_detour = max_detour
+        self.min_detour = min_detour_minutes
+        
+        # Distance rows from stop locations, kept across plans while the graph is unchanged
+        self.max_rows = max_rows
+        self.rows = OrderedDict()
+        self.rows_version = None
+    
+    def load_rows(self, nodes: List[int], processes: Optional[int] = None):
+        """Make sure a full distance row is cached for every node, computing only the missing ones"""
+        graph = self.graph
+        if not graph.frozen:
+            graph.freeze()
+        if self.rows_version != graph.version:
+            self.rows.clear()
+            self.rows_version = graph.version
+        
+        missing = [node for node in nodes if node not in self.rows]
+        if missing:
+            matrix = graph.distance_matrix(missing, graph.node_ids, processes)
+            for node, row in zip(missing, matrix):
+                self.rows[node] = row
+        for node in nodes:
+            self.rows.move_to_end(node)
+        while len(self.rows) > max(self.max_rows, len(nodes)):
+            self.rows.popitem(last=False)
+    
+    def plan(self, rides: List[RideRequest], capacity: int, processes: Optional[int] = None) -> List[RidePool]:
+        """Cheapest-insertion pooling in time order; rides that can't share get a pool of their own"""
+        if not rides:
+            return []
+        base = min(ride.scheduled_time for ride in rides)
+        ready = [(ride.scheduled_time - base).total_seconds() / 60 for ride in rides]
+        pickups = [self.graph.find_location(ride.pickup) for ride in rides]
+        dropoffs = [self.graph.find_location(ride.dropoff) for ride in rides]
+        
+        # Distance rows from every stop location involved
+        self.load_rows(sorted({node for node in pickups + dropoffs if node is not None}), processes)
+        rows = self.rows
+        node_index = self.graph.node_index
+        
+        def minutes(a, b):
+            return rows[a][node_index[b]]
+        
+        direct = [minutes(p, d) if p is not None and d is not None else math.inf
+                  for p, d in zip(pickups, dropoffs)]
+        
+        def evaluate(stops):
+            """(driving minutes, route minutes, peak load, total pickup delay) or None if a constraint breaks"""
+            load = peak = 0
+            driving = delay = 0.0
+            picked_up = {}
+            clock = ready[stops[0][0]]
+            first = clock
+            for k, (i, action, node) in enumerate(stops):
+                if k:
+                    leg = minutes(stops[k - 1][2], node)
+                    driving += leg
+                    clock += leg
+                if action == "pickup":
+                    clock = max(clock, ready[i])
+                    if clock - ready[i] > self.window:
+                        return None
+                    delay += clock - ready[i]
+                    load += rides[i].passengers
+                    if load > capacity:
+                        return None
+                    peak = max(peak, load)
+                    picked_up[i] = clock
+                else:
+                    load -= rides[i].passengers
+                    if clock - picked_up[i] > direct[i] * (1 + self.max_detour) + self.min_detour:
+                        return None
+            return driving, clock - first, peak, delay
+        
+        pools = []
+        open_pools = []    # (stops, driving, route minutes, peak), in creation order
+        anchors = []       # ready time of each open pool's first ride, ascending
+        members = []
+        for i in sorted(range(len(rides)), key=lambda i: ready[i]):
+            if not math.isfinite(direct[i]) or rides[i].passengers > capacity:
+                pools.append(RidePool([i], [(i, "pickup", pickups[i]), (i, "dropoff", dropoffs[i])],
+                                      rides[i].scheduled_time, rides[i].estimated_time or 0, rides[i].passengers))
+                continue
+            
+            # Only pools started within the window can take this ride on time
+            best = None
+            for p in range(bisect.bisect_left(anchors, ready[i] - self.window), len(open_pools)):
+                stops, driving, _, _ = open_pools[p]
+                # The vehicle reaches the pickup from some stop, each ready no earlier than a window ago
+                if (min(minutes(stop[2], pickups[i]) for stop in stops) > 2 * self.window
+                        and minutes(pickups[i], stops[0][2]) > self.window):
+                    continue
+                for a in range(len(stops) + 1):
+                    for b in range(a, len(stops) + 1):
+                        candidate = (stops[:a] + [(i, "pickup", pickups[i])] + stops[a:b]
+                                     + [(i, "dropoff", dropoffs[i])] + stops[b:])
+                        result = evaluate(candidate)
+                        if result is None:
+                            continue
+                        # Sharing must save vehicle time over serving the ride alone
+                        added = (result[0] - driving, result[3])
+                        if added[0] < direct[i] and (best is None or added < best[0]):
+                            best = (added, p, candidate, result)
+            
+            if best is None:
+                open_pools.append(([(i, "pickup", pickups[i]), (i, "dropoff", dropoffs[i])],
+                                   direct[i], direct[i], rides[i].passengers))
+                anchors.append(ready[i])
+                members.append([i])
+            else:
+                _, p, candidate, (driving, route_minutes, peak, _) = best
+                open_pools[p] = (candidate, driving, route_minutes, peak)
+                members[p].append(i)
+        
+        for (stops, _, route_minutes, peak), rides_in_pool in zip(open_pools, members):
+            start = base + timedelta(minutes=ready[stops[0][0]])
+            pools.append(RidePool(sorted(rides_in_pool), stops, start, route_minutes, peak))
+        return pools
+
+# Batch dispatching
+def solve_assignment(cost: np.ndarray) -> tuple:
+    """Minimum-cost rectangular assignment, returning (row_indices, col_indices)"""
+    if linear_sum_assignment is not None:
+        return linear_sum_assignment(cost)
+    
+    # Hungarian algorithm (shortest augmenting paths), vectorized over columns
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    assigned_row = np.zeros(m + 1, dtype=np.int64)  # 1-based row per column, 0 = free
+    way = np.zeros(m + 1, dtype=np.int64)
+    
+    for row in range(1, n + 1):
+        assigned_row[0] = row
+        column = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[column] = True
+            current_row = assigned_row[column]
+            slack = cost[current_row - 1] - u[current_row] - v[1:]
+            free = ~used[1:]
+            better = free & (slack < min_slack[1:])
+            min_slack[1:][better] = slack[better]
+            way[1:][better] = column
+            
+            candidates = np.where(free, min_slack[1:], np.inf)
+            next_column = int(np.argmin(candidates)) + 1
+            delta = candidates[next_column - 1]
+            u[assigned_row[used]] += delta
+            v[used] -= delta
+            min_slack[~used] -= delta
+            column = next_column
+            if assigned_row[column] == 0:
+                break
+        
+        while column:
+            previous = way[column]
+            assigned_row[column] = assigned_row[previous]
+            column = previous
+    
+    columns = np.nonzero(assigned_row[1:])[0]
+    rows = assigned_row[1:][columns] - 1
+    order = np.argsort(rows)
+    rows, columns = rows[order], columns[order]
+    return (columns, rows) if transposed else (rows, columns)
+
+class BatchDispatcher:
+    """Assigns pending rides to available drivers by minimum total travel to the pickup"""
+    
+    INFEASIBLE = 1e9
+    UNKNOWN_POSITION_COST = 60.0  # minutes, for drivers with no known location
+    
+    def __init__(self, graph: TransportationGraph, reassign_after: timedelta = timedelta(minutes=30),
+                 pooling: bool = POOL_RIDES):
+        self.graph = graph
+        # Scheduled rides starting later than this may be handed to a closer driver
+        self.reassign_after = reassign_after
+        # Shared rides are re-planned from scratch on every dispatch
+        self.pooler = PoolingEngine(graph) if pooling else None
+    
+    def build_cost_matrix(self, rides: List[RideRequest], drivers: List[Driver]) -> np.ndarray:
+        """Minutes from each driver to each pickup; INFEASIBLE where the vehicle can't serve the ride"""
+        driver_nodes = [self.graph.find_location(d.current_location) if d.current_location
+                        else self.graph.nearest_node(d.position) if d.position else None
+                        for d in drivers]
+        pickup_nodes = [self.graph.find_location(r.pickup) for r in rides]
+        sources = sorted({node for node in driver_nodes if node is not None})
+        targets = sorted({node for node in pickup_nodes if node is not None})
+        source_row = {node: i for i, node in enumerate(sources)}
+        target_column = {node: j for j, node in enumerate(targets)}
+        
+        cost = np.full((len(drivers), len(rides)), self.UNKNOWN_POSITION_COST)
+        if sources and targets:
+            travel = self.graph.distance_matrix(sources, targets)
+            rows = np.array([source_row.get(node, -1) for node in driver_nodes])
+            columns = np.array([target_column.get(node, -1) for node in pickup_nodes])
+            known = np.ix_(rows >= 0, columns >= 0)
+            cost[known] = travel[np.ix_(rows[rows >= 0], columns[columns >= 0])]
+        cost[~np.isfinite(cost)] = self.INFEASIBLE
+        
+        # Accessibility and capacity constraints, with features as bitmasks
+        bits = {feature: 1 << i for i, feature in enumerate(VEHICLE_FEATURES)}
+        has = np.array([sum(bits.get(f, 0) for f in d.vehicle_features) for d in drivers], dtype=np.int64)
+        needs = np.array([sum(bits[f] for f in required_features(r.accessibility_requirements)) for r in rides],
+                         dtype=np.int64)
+        capacity = np.array([d.capacity for d in drivers])
+        passengers = np.array([r.passengers for r in rides])
+        infeasible = ((needs[None, :] & ~has[:, None]) != 0) | (passengers[None, :] > capacity[:, None])
+        
+        # Drivers already booked during the trip window; a ride's own booking doesn't count
+        usernames = [d.username for d in drivers]
+        busy = driver_schedule.busy_matrix(usernames, [ride_window(r) for r in rides])
+        driver_row = {username: i for i, username in enumerate(usernames)}
+        for j, ride in enumerate(rides):
+            if ride.driver_id in driver_row:
+                busy[driver_row[ride.driver_id], j] = False
+        
+        cost[infeasible | busy] = self.INFEASIBLE
+        return cost
+    
+    def solve(self, rides: List[RideRequest], drivers: List[Driver]) -> List[tuple]:
+        """(ride index, driver index, minutes) for every feasible assignment"""
+        if not rides or not drivers:
+            return []
+        cost = self.build_cost_matrix(rides, drivers)
+        driver_indices, ride_indices = solve_assignment(cost)
+        return [(int(j), int(i), float(cost[i, j])) for i, j in zip(driver_indices, ride_indices)
+                if cost[i, j] < self.INFEASIBLE]
+    
+    def dispatch(self) -> int:
+        """Re-solve pending (and not yet imminent scheduled) rides, pooling them if enabled; returns rides updated"""
+        horizon = datetime.now() + self.reassign_after
+        # Rides the day planner has chained (route_order set) belong to that plan, not to this pass
+        ride_docs = list(rides_collection.find({"$or": [
+            {"status": "pending"},
+            {"status": "scheduled", "scheduled_time": {"$gt": horizon}, "route_order": None}
+        ]}))
+        drivers = [Driver.from_dict(d) for d in drivers_collection.find({"availability": True})]
+        rides = [RideRequest.from_dict(doc) for doc in ride_docs]
+        
+        # Each pool is dispatched as one trip sized by its peak load
+        if self.pooler is not None:
+            pools = self.pooler.plan(rides, max((d.capacity for d in drivers), default=0))
+            trips = [pool.as_ride(rides) for pool in pools]
+        else:
+            pools = None
+            trips = rides
+        
+        # Pool fields every re-planned ride carries under this plan
+        planned = {}
+        for pool in pools or []:
+            shared = len(pool.rides) > 1
+            pool_fields = {
+                "pool_id": str(ride_docs[pool.rides[0]]["_id"]) if shared else None,
+                "pool_stops": [
+                    {"ride_id": str(ride_docs[i]["_id"]), "stop": action,
+                     "location": rides[i].pickup if action == "pickup" else rides[i].dropoff}
+                    for i, action, _ in pool.stops
+                ] if shared else []
+            }
+            for i in pool.rides:
+                planned[i] = pool_fields
+        
+        updates = []
+        assigned = set()
+        for trip_index, driver_index, _ in self.solve(trips, drivers):
+            fields = {"driver_id": drivers[driver_index].username, "status": "scheduled"}
+            members = [trip_index]
+            if pools is not None:
+                members = pools[trip_index].rides
+                fields.update(planned[members[0]])
+            
+            for ride_index in members:
+                assigned.add(ride_index)
+                doc = ride_docs[ride_index]
+                if all(doc.get(key) == value for key, value in fields.items()):
+                    continue
+                # Status precondition keeps rides a driver has already started untouched
+                updates.append(({"_id": doc["_id"], "status": doc["status"]}, dict(fields)))
+        
+        # Rides left unassigned keep their driver, but not a pool this plan broke up
+        cleared = []
+        for ride_index, doc in enumerate(ride_docs):
+            if ride_index in assigned or not doc.get("pool_id") or ride_index not in planned:
+                continue
+            if (doc["pool_id"] == planned[ride_index]["pool_id"]
+                    and doc.get("pool_stops") == planned[ride_index]["pool_stops"]):
+                continue
+            cleared.append(UpdateOne(
+                {"_id": doc["_id"], "status": doc["status"]},
+                {"$set": {"pool_id": None, "pool_stops": []}}
+            ))
+        
+        if not updates and not cleared:
+            return 0
+        
+        def work(session):
+            if cleared:
+                rides_collection.bulk_write(cleared, ordered=False, session=session)
+            return len(update_rides(updates, session))
+        
+        changed = run_transaction(work)
+        driver_schedule.refresh()
+        return changed
+    
+    def run(self, interval: float, stop: threading.Event):
+        while not stop.wait(interval):
+            try:
+                assigned = self.dispatch()
+                if assigned:
+                    print(f"✅ Dispatcher assigned {assigned} rides")
+            except PyMongoError as e:
+                print(f"❌ Dispatch failed: {e}")
+
+_dispatcher_stop = None
+
+def start_batch_dispatcher(graph: TransportationGraph, interval: float = DISPATCH_INTERVAL):
+    """Start the periodic dispatcher thread once per process"""
+    global _dispatcher_stop
+    if interval <= 0 or _dispatcher_stop is not None:
+        return
+    _dispatcher_stop = threading.Event()
+    threading.Thread(target=BatchDispatcher(graph).run, args=(interval, _dispatcher_stop),
+                     daemon=True).start()
+
+# Day planning
+def _day_plan_restart(problem: dict, seed: int) -> tuple:
+    """Process-pool entry point for one DayPlanner restart"""
+    return DayPlanner.solve(problem, seed)
+
+class DayPlanner:
+    """Orders a day's scheduled rides into one route per driver, minimizing deadhead travel"""
+    
+    INFEASIBLE = 1e9
+    UNPLANNED_PENALTY = 1e6  # an unserved ride outweighs any amount of deadhead
+    
+    def __init__(self, graph: TransportationGraph, restarts: int = 8, processes: Optional[int] = None):
+        self.graph = graph
+        self.restarts = restarts
+        self.processes = processes
+    
+    def build_problem(self, rides: List[RideRequest], drivers: List[Driver],
+                      pools: Optional[List[Optional[str]]] = None,
+                      loads: Optional[Dict[str, int]] = None) -> dict:
+        """Group pooled rides into units and precompute every deadhead cost the solver needs"""
+        groups = {}
+        for i, pool_id in enumerate(pools or [None] * len(rides)):
+            groups.setdefault(pool_id if pool_id else ("ride", i), []).append(i)
+        units = sorted(groups.values(), key=lambda members: min(rides[i].scheduled_time for i in members))
+        
+        windows = [[ride_window(rides[i]) for i in members] for members in units]
+        base = min((start for unit in windows for start, _ in unit), default=0)
+        start = np.array([min(s for s, _ in unit) - base for unit in windows]) / 60
+        end = np.array([max(e for _, e in unit) - base for unit in windows]) / 60
+        first_ride = [min(members, key=lambda i: rides[i].scheduled_time) for members in units]
+        last_ride = [max(members, key=lambda i: ride_window(rides[i])[1]) for members in units]
+        pickups = [self.graph.find_location(rides[i].pickup) for i in first_ride]
+        dropoffs = [self.graph.find_location(rides[i].dropoff) for i in last_ride]
+        driver_nodes = [self.graph.find_location(d.current_location) if d.current_location
+                        else self.graph.nearest_node(d.position) if d.position else None
+                        for d in drivers]
+        
+        # Deadhead minutes between stop locations, one matrix for the whole day
+        sources = sorted({node for node in dropoffs + driver_nodes if node is not None})
+        targets = sorted({node for node in pickups if node is not None})
+        travel = self.graph.distance_matrix(sources, targets, self.processes) if sources and targets else None
+        source_row = {node: i for i, node in enumerate(sources)}
+        target_column = {node: j for j, node in enumerate(targets)}
+        
+        def deadhead(a, b):
+            if a is None or b is None:
+                return BatchDispatcher.UNKNOWN_POSITION_COST
+            minutes = travel[source_row[a], target_column[b]]
+            return minutes if math.isfinite(minutes) else self.INFEASIBLE
+        
+        # link[u, v]: driving from unit u's last dropoff to unit v's pickup, if there is time
+        n = len(units)
+        link = np.full((n, n), self.INFEASIBLE)
+        for u in range(n):
+            for v in np.nonzero(start >= end[u])[0]:
+                minutes = deadhead(dropoffs[u], pickups[v])
+                if end[u] + minutes <= start[v]:
+                    link[u, v] = minutes
+        
+        # first[d, u]: driver d's start position to unit u, INFEASIBLE if the vehicle can't serve it
+        first = np.full((len(drivers), n), self.INFEASIBLE)
+        # A pool needs room for its peak load (loads), or for every member when that is unknown
+        peaks = [(loads or {}).get(pools[members[0]]) if pools else None for members in units]
+        peaks = [peak or sum(rides[i].passengers for i in members) for peak, members in zip(peaks, units)]
+        for d, driver in enumerate(drivers):
+            features = set(driver.vehicle_features)
+            for u, members in enumerate(units):
+                needs = {f for i in members for f in required_features(rides[i].accessibility_requirements)}
+                if needs <= features and peaks[u] <= driver.capacity:
+                    first[d, u] = deadhead(driver_nodes[d], pickups[u])
+        
+        return {"units": units, "start": start, "link": link, "first": first}
+    
+    @classmethod
+    def route_cost(cls, problem: dict, d: int, route: List[int]) -> float:
+        if not route:
+            return 0.0
+        link, first = problem["link"], problem["first"]
+        if any(first[d, u] >= cls.INFEASIBLE for u in route):
+            return cls.INFEASIBLE
+        return first[d, route[0]] + sum(link[a, b] for a, b in zip(route, route[1:]))
+    
+    @classmethod
+    def cover(cls, problem: dict) -> List[List[int]]:
+        """Give every unit its cheapest predecessor (another unit or a driver) in one assignment
+        
+        Links only run forward in time, so the result is a set of chains; it is optimal when all
+        vehicles can serve all rides, and chains that reach an unsuitable vehicle are cut short.
+        """
+        link, first = problem["link"], problem["first"]
+        n, drivers = link.shape[0], first.shape[0]
+        if not n or not drivers:
+            return [[] for _ in range(drivers)]
+        unserved = np.full((n, n), cls.INFEASIBLE)
+        np.fill_diagonal(unserved, cls.UNPLANNED_PENALTY)
+        cost = np.vstack([link, np.where(first < cls.INFEASIBLE, first, cls.INFEASIBLE), unserved])
+        successor = {}
+        for row, column in zip(*solve_assignment(cost)):
+            if row < n + drivers and cost[row, column] < cls.INFEASIBLE:
+                successor[row] = column
+        
+        routes = []
+        for d in range(drivers):
+            route = []
+            u = successor.get(n + d)
+            while u is not None and first[d, u] < cls.INFEASIBLE:
+                route.append(u)
+                u = successor.get(u)
+            routes.append(route)
+        return routes
+    
+    @classmethod
+    def construct(cls, problem: dict, rng: random.Random, noise: float) -> List[List[int]]:
+        """Randomized Clarke-Wright savings: chain units, then give chains to drivers"""
+        link, first = problem["link"], problem["first"]
+        n, drivers = link.shape[0], first.shape[0]
+        if not n or not drivers:
+            return [[] for _ in range(drivers)]
+        served = first < cls.INFEASIBLE
+        head_cost = np.where(served, first, np.inf).min(axis=0)
+        
+        # Linking u -> v saves v's cheapest start from a driver, less the deadhead between them
+        pairs = [(head_cost[v] - link[u, v], u, v) for u, v in zip(*np.nonzero(link < cls.INFEASIBLE))
+                 if np.isfinite(head_cost[v])]
+        pairs.sort(key=lambda p: -p[0] * (1 + rng.uniform(-noise, noise)) if noise else -p[0])
+        
+        chains = {u: [u] for u in range(n)}
+        chain_of = list(range(n))
+        can_serve = {u: served[:, u].copy() for u in range(n)}
+        for saving, u, v in pairs:
+            a, b = chain_of[u], chain_of[v]
+            if a == b or chains[a][-1] != u or chains[b][0] != v:
+                continue
+            # Past the point of saving, merge only while there are more chains than drivers
+            if saving <= 0 and len(chains) <= drivers:
+                continue
+            combined = can_serve[a] & can_serve[b]
+            if not combined.any():
+                continue
+            chains[a].extend(chains[b])
+            for w in chains.pop(b):
+                chain_of[w] = a
+            can_serve[a] = combined
+            del can_serve[b]
+        
+        keys = list(chains)
+        cost = np.full((drivers, len(keys)), cls.INFEASIBLE)
+        for j, key in enumerate(keys):
+            chain = chains[key]
+            tail = sum(link[a, b] for a, b in zip(chain, chain[1:]))
+            cost[can_serve[key], j] = first[can_serve[key], chain[0]] + tail
+        routes = [[] for _ in range(drivers)]
+        for d, j in zip(*solve_assignment(cost)):
+            if cost[d, j] < cls.INFEASIBLE:
+                routes[d] = chains[keys[j]]
+        return routes
+    
+    @classmethod
+    def improve(cls, problem: dict, routes: List[List[int]]) -> List[List[int]]:
+        """Relocate and swap units between drivers (and place unplanned ones) until nothing improves"""
+        start, first = problem["start"], problem["first"]
+        n = problem["link"].shape[0]
+        costs = [cls.route_cost(problem, d, route) for d, route in enumerate(routes)]
+        
+        link = problem["link"]
+        
+        def insert(route, u):
+            """route with u in time order, or None if it can't link to its neighbours"""
+            position = bisect.bisect_left([start[w] for w in route], start[u])
+            if position and link[route[position - 1], u] >= cls.INFEASIBLE:
+                return None
+            if position < len(route) and link[u, route[position]] >= cls.INFEASIBLE:
+                return None
+            return route[:position] + [u] + route[position:]
+        
+        def try_move(changes, gain):
+            """Apply {driver: new route} if feasible and the objective drops by more than gain"""
+            if any(route is None for route in changes.values()):
+                return False
+            new_costs = {d: cls.route_cost(problem, d, route) for d, route in changes.items()}
+            if any(cost >= cls.INFEASIBLE for cost in new_costs.values()):
+                return False
+            if sum(new_costs.values()) - sum(costs[d] for d in changes) < gain - 1e-9:
+                for d, route in changes.items():
+                    routes[d] = route
+                    costs[d] = new_costs[d]
+                return True
+            return False
+        
+        def eject(u, target, owner):
+            """Place unplanned u by bumping the one unit it clashes with, if that unit fits elsewhere"""
+            clashes = [w for w in routes[target]
+                       if link[w, u] >= cls.INFEASIBLE and link[u, w] >= cls.INFEASIBLE]
+            if len(clashes) != 1:
+                return False
+            v = clashes[0]
+            for other in range(len(routes)):
+                if other == target or first[other, v] >= cls.INFEASIBLE:
+                    continue
+                if try_move({target: insert([w for w in routes[target] if w != v], u),
+                             other: insert(routes[other], v)}, cls.UNPLANNED_PENALTY):
+                    owner[v] = other
+                    return True
+            return False
+        
+        improved = True
+        while improved:
+            improved = False
+            owner = {u: d for d, route in enumerate(routes) for u in route}
+            for u in range(n):
+                source = owner.get(u)
+                for target in range(len(routes)):
+                    if target == source or first[target, u] >= cls.INFEASIBLE:
+                        continue
+                    if source is None:
+                        moved = try_move({target: insert(routes[target], u)}, cls.UNPLANNED_PENALTY)
+                        if not moved:
+                            moved = eject(u, target, owner)
+                    else:
+                        moved = try_move({source: [w for w in routes[source] if w != u],
+                                          target: insert(routes[target], u)}, 0)
+                    if moved:
+                        owner[u] = target
+                        improved = True
+                        break
+            
+            # Swaps only help between units that overlap in time, where a plain relocate can't fit
+            for u in range(n):
+                for v in range(u + 1, n):
+                    a, b = owner.get(u), owner.get(v)
+                    if a is None or b is None or a == b or abs(start[u] - start[v]) > 120:
+                        continue
+                    if first[b, u] >= cls.INFEASIBLE or first[a, v] >= cls.INFEASIBLE:
+                        continue
+                    if try_move({a: insert([w for w in routes[a] if w != u], v),
+                                 b: insert([w for w in routes[b] if w != v], u)}, 0):
+                        owner[u], owner[v] = b, a
+                        improved = True
+        return routes
+    
+    @classmethod
+    def solve(cls, problem: dict, seed: int, routes: Optional[List[List[int]]] = None) -> tuple:
+        """(objective, routes) from one restart; seed 0 is the assignment cover, others randomized savings"""
+        if routes is None:
+            routes = cls.cover(problem) if seed == 0 else cls.construct(problem, random.Random(seed), 0.3)
+        routes = cls.improve(problem, routes)
+        planned = sum(len(route) for route in routes)
+        objective = (sum(cls.route_cost(problem, d, route) for d, route in enumerate(routes))
+                     + cls.UNPLANNED_PENALTY * (problem["link"].shape[0] - planned))
+        return objective, routes
+    
+    def plan(self, rides: List[RideRequest], drivers: List[Driver],
+             pools: Optional[List[Optional[str]]] = None,
+             loads: Optional[Dict[str, int]] = None) -> Tuple[Dict[str, List[int]], List[int]]:
+        """({driver username: ride indices in route order}, unplanned ride indices)"""
+        problem = self.build_problem(rides, drivers, pools, loads)
+        units = problem["units"]
+        
+        # The current assignment, repaired, competes with the restarts so a plan never serves fewer rides
+        driver_index = {driver.username: d for d, driver in enumerate(drivers)}
+        current = [[] for _ in drivers]
+        for u, members in enumerate(units):
+            d = driver_index.get(rides[members[0]].driver_id)
+            if d is not None and all(rides[i].driver_id == rides[members[0]].driver_id for i in members):
+                current[d].append(u)
+        for d, route in enumerate(current):
+            kept = []
+            for u in route:
+                if self.route_cost(problem, d, kept + [u]) < self.INFEASIBLE:
+                    kept.append(u)
+            current[d] = kept
+        results = [self.solve(problem, -1, current)]
+        
+        seeds = range(max(1, self.restarts))
+        if self.processes and self.processes > 1 and len(seeds) > 1:
+            with ProcessPoolExecutor(max_workers=self.processes) as pool:
+                results.extend(pool.map(_day_plan_restart, [problem] * len(seeds), seeds))
+        else:
+            results.extend(self.solve(problem, seed) for seed in seeds)
+        _, routes = min(results, key=lambda result: result[0])
+        
+        plan = {}
+        for d, route in enumerate(routes):
+            if route:
+                plan[drivers[d].username] = [i for u in route
+                                             for i in sorted(units[u], key=lambda i: rides[i].scheduled_time)]
+        planned = {i for route in plan.values() for i in route}
+        return plan, [i for i in range(len(rides)) if i not in planned]
+    
+    @staticmethod
+    def pool_loads(ride_docs: List[dict]) -> Dict[str, int]:
+        """Peak passengers aboard each pool, replaying its stored stop order"""
+        passengers = {str(doc["_id"]): doc.get("passengers", 1) for doc in ride_docs}
+        loads = {}
+        for doc in ride_docs:
+            if not doc.get("pool_id") or not doc.get("pool_stops") or doc["pool_id"] in loads:
+                continue
+            load = peak = 0
+            for stop in doc["pool_stops"]:
+                load += passengers.get(stop["ride_id"], 0) * (1 if stop["stop"] == "pickup" else -1)
+                peak = max(peak, load)
+            loads[doc["pool_id"]] = peak
+        return loads
+    
+    def plan_day(self, day: Optional[date] = None) -> dict:
+        """Plan tomorrow's (or the given day's) scheduled rides and store route_order on each ride"""
+        day = day or (datetime.now() + timedelta(days=1)).date()
+        day_start = datetime.combine(day, datetime.min.time())
+        ride_docs = list(rides_collection.find({
+            "status": "scheduled",
+            "scheduled_time": {"$gte": day_start, "$lt": day_start + timedelta(days=1)}
+        }))
+        drivers = [Driver.from_dict(d) for d in drivers_collection.find({"availability": True})]
+        # availability is live; rides held by a driver who is off shift right now stay as booked
+        usernames = {driver.username for driver in drivers}
+        ride_docs = [doc for doc in ride_docs if not doc.get("driver_id") or doc["driver_id"] in usernames]
+        rides = [RideRequest.from_dict(doc) for doc in ride_docs]
+        plan, unplanned = self.plan(rides, drivers, [doc.get("pool_id") for doc in ride_docs],
+                                    self.pool_loads(ride_docs))
+        
+        updates = []
+        for username, route in plan.items():
+            order = 0
+            for position, i in enumerate(route):
+                # Pooled rides share the stop number of the trip they ride in
+                if position and not (ride_docs[i].get("pool_id")
+                                     and ride_docs[i].get("pool_id") == ride_docs[route[position - 1]].get("pool_id")):
+                    order += 1
+                updates.append(UpdateOne(
+                    {"_id": ride_docs[i]["_id"], "status": "scheduled"},
+                    {"$set": {"driver_id": username, "route_order": order}}
+                ))
+        # Rides the planner can't chain stay booked with their driver, just outside the stop order
+        for i in unplanned:
+            if ride_docs[i].get("route_order") is not None:
+                updates.append(UpdateOne(
+                    {"_id": ride_docs[i]["_id"], "status": "scheduled"},
+                    {"$set": {"route_order": None}}
+                ))
+        
+        if updates:
+            rides_collection.bulk_write(updates, ordered=False)
+            driver_schedule.refresh()
+        return {"rides": len(rides), "drivers": len(plan),
+                "unplanned": [str(ride_docs[i]["_id"]) for i in unplanned]}
+
+# Index bootstrap
+QUERY_INDEXES = [
+    (users_collection, [("username", 1)], {"unique": True, "name": "username_unique"}),
+    # _id is the keyset tie-breaker, so history pages come straight off the index with no sort
+    (rides_collection, [("user_id", 1), ("scheduled_time", 1), ("_id", 1)], {"name": "user_history"}),
+    (rides_collection, [("driver_id", 1), ("status", 1), ("scheduled_time", 1)], {"name": "driver_rides"}),
+    (drivers_collection, [("username", 1)], {"unique": True, "name": "driver_username_unique"}),
+    # Covers date-range analytics: the $group stages read pickup and status straight from the index
+    (rides_collection, [("scheduled_time", 1), ("pickup", 1), ("status", 1)], {"name": "ride_analytics"}),
+    # The dispatcher's pending/upcoming queue: each $or branch needs its own index or the whole query scans
+    (rides_collection, [("status", 1), ("scheduled_time", 1)], {"name": "ride_status"}),
+]
+
+def ensure_indexes():
+    """Create every index the app's queries rely on; idempotent, so it runs on each startup"""
+    for collection, keys, options in QUERY_INDEXES:
+        try:
+            collection.create_index(keys, **options)
+        except PyMongoError as e:
+            # e.g. duplicate usernames already stored block a unique index
+            print(f"❌ Could not create index {options['name']} on {collection.name}: {e}")
+    try:
+        DriverCapabilityIndex.ensure_indexes()
+        DriverLocator.ensure_indexes()
+        RideRollups.ensure_indexes()
+    except PyMongoError as e:
+        print(f"❌ Could not create driver or rollup indexes: {e}")
+
+def find_stage(plan, stage: str) -> Optional[dict]:
+    """First node of an explain() plan tree with the given stage, searching depth-first"""
+    if isinstance(plan, dict):
+        if plan.get("stage") == stage:
+            return plan
+        plan = list(plan.values())
+    if isinstance(plan, list):
+        for child in plan:
+            found = find_stage(child, stage)
+            if found is not None:
+                return found
+    return None
+
+def scanned_index(plan) -> Optional[str]:
+    """Index a winning plan scans, or None if any branch of it (e.g. one side of an $or) is a COLLSCAN"""
+    scan = find_stage(plan, "IXSCAN")
+    if scan is None or find_stage(plan, "COLLSCAN") is not None:
+        return None
+    return scan.get("indexName")
+
+def check_query_plans() -> Dict[str, Optional[str]]:
+    """Explain the app's hot queries; maps each to the index it scans, or None for a COLLSCAN"""
+    queries = {
+        "login/register by username": (users_collection, {"username": "user1"}, None),
+        "ride history": (rides_collection, {"user_id": "user1"}, [("scheduled_time", -1), ("_id", -1)]),
+        "driver rides": (rides_collection, {"driver_id": "driver1"}, [("scheduled_time", 1)]),
+        "next ride to start": (rides_collection, {"driver_id": "driver1", "status": "scheduled"},
+                               [("scheduled_time", 1)]),
+        "driver schedule": (rides_collection, {"status": {"$in": ["scheduled", "in_progress"]},
+                                               "driver_id": {"$ne": None},
+                                               "scheduled_time": {"$gte": datetime.now()}}, None),
+        "driver by username": (drivers_collection, {"username": "driver1"}, None),
+        "available drivers": (drivers_collection, {"availability": True}, None),
+        "analytics date range": (rides_collection, {"scheduled_time": {"$gte": datetime.now() - timedelta(days=30)}},
+                                 None),
+        "dispatch queue": (rides_collection, {"$or": [
+            {"status": "pending"},
+            {"status": "scheduled", "scheduled_time": {"$gt": datetime.now()}, "route_order": None}
+        ]}, None),
+        "analytics rollups": (rollups_collection, {"count": {"$gt": 0}, "day": {"$gte": ""}}, None),
+    }
+    results = {}
+    for label, (collection, query, sort) in queries.items():
+        cursor = collection.find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+        results[label] = scanned_index(cursor.explain()["queryPlanner"]["winningPlan"])
+    return results
+
+# Paged ride history
+HISTORY_PAGE_SIZE = 20
+HISTORY_FIELDS = {"user_id": 1, "pickup": 1, "dropoff": 1, "scheduled_time": 1, "status": 1, "driver_id": 1,
+                  "estimated_time": 1, "distance": 1, "accessibility_requirements": 1}
+
+def ride_history_page(user_id: str, after: Optional[tuple] = None,
+                      limit: int = HISTORY_PAGE_SIZE) -> Tuple[List[dict], Optional[tuple]]:
+    """A page of a user's rides, newest first, and the (scheduled_time, _id) key for the next page (None at the end)"""
+    query = {"user_id": user_id}
+    if after is not None:
+        # Keyset pagination: the range bound keeps it one index scan, the $or breaks ties by _id
+        scheduled_time, ride_id = after
+        query["scheduled_time"] = {"$lte": scheduled_time}
+        query["$or"] = [{"scheduled_time": {"$lt": scheduled_time}}, {"_id": {"$lt": ride_id}}]
+    documents = list(rides_collection.find(query, HISTORY_FIELDS)
+                     .sort([("scheduled_time", -1), ("_id", -1)])
+                     .limit(limit))
+    if len(documents) < limit:
+        return documents, None
+    return documents, (documents[-1]["scheduled_time"], documents[-1]["_id"])
+
+# Analytics
+def ride_analytics(start: Optional[datetime] = None, end: Optional[datetime] = None,
+                   driver_id: Optional[str] = None) -> dict:
+    """Ride counts per pickup and per status, grouped in Mongo; end is exclusive
     
-    def to_dict(self):
-        return asdict(self)
+    Returns {"pickups": [(pickup, count), ...] busiest first, "statuses": {status: count}}.
+    """
+    match = {}
+    if start is not None or end is not None:
+        match["scheduled_time"] = {}
+        if start is not None:
+            match["scheduled_time"]["$gte"] = start
+        if end is not None:
+            match["scheduled_time"]["$lt"] = end
+    if driver_id:
+        match["driver_id"] = driver_id
+    
+    # One round trip; only a row per pickup and per status comes back
+    pipeline = [
+        {"$match": match},
+        {"$facet": {
+            "pickups": [{"$group": {"_id": "$pickup", "count": {"$sum": 1}}},
+                        {"$sort": {"count": -1, "_id": 1}}],
+            "statuses": [{"$group": {"_id": "$status", "count": {"$sum": 1}}}]
+        }}
+    ]
+    result = next(rides_collection.aggregate(pipeline), {"pickups": [], "statuses": []})
+    return {
+        "pickups": [(row["_id"], row["count"]) for row in result["pickups"]],
+        "statuses": {row["_id"]: row["count"] for row in result["statuses"]}
+    }
+
+# Analytics rollups
+_transactions_supported = None
+
+def run_transaction(work):
+    """Run work(session) in a transaction; on servers without transactions, run it without one"""
+    global _transactions_supported
+    if _transactions_supported is not False:
+        try:
+            with client.start_session() as session:
+                result = session.with_transaction(work)
+            _transactions_supported = True
+            return result
+        except OperationFailure as e:
+            # IllegalOperation: a standalone mongod has no transactions (replica sets and mongos do)
+            if e.code != 20 or _transactions_supported:
+                raise
+            _transactions_supported = False
+            print("⚠️ MongoDB transactions unavailable; ride rollups are updated without them")
+    return work(None)
+
+class RideRollups:
+    """Ride counters per (day, pickup, status), changed in the same transaction as the rides"""
+    
+    @staticmethod
+    def ensure_indexes():
+        rollups_collection.create_index([("day", 1), ("pickup", 1), ("status", 1)],
+                                        unique=True, name="rollup_bucket")
+    
+    @staticmethod
+    def bucket(ride_data: dict, status: Optional[str] = None) -> tuple:
+        return ride_data["scheduled_time"].strftime("%Y-%m-%d"), ride_data["pickup"], status or ride_data["status"]
     
     @classmethod
-    def from_dict(cls, data):
-        return cls(
-            user_id=data["user_id"],
-            pickup=data["pickup"],
-            dropoff=data["dropoff"],
-            scheduled_time=data["scheduled_time"],
-            status=data.get("status", "pending"),
-            accessibility_requirements=data.get("accessibility_requirements", []),
-            driver_id=data.get("driver_id"),
-            estimated_time=data.get("estimated_time"),
-            distance=data.get("distance"),
-            created_at=data.get("created_at", datetime.now())
+    def inserted(cls, ride_docs: List[dict]) -> Dict[tuple, int]:
+        deltas = {}
+        for ride_data in ride_docs:
+            key = cls.bucket(ride_data)
+            deltas[key] = deltas.get(key, 0) + 1
+        return deltas
+    
+    @classmethod
+    def moved(cls, ride_docs: List[dict], status: str) -> Dict[tuple, int]:
+        """Deltas for rides (as they were before) changing to status"""
+        deltas = {}
+        for ride_data in ride_docs:
+            if ride_data["status"] == status:
+                continue
+            old, new = cls.bucket(ride_data), cls.bucket(ride_data, status)
+            deltas[old] = deltas.get(old, 0) - 1
+            deltas[new] = deltas.get(new, 0) + 1
+        return deltas
+    
+    @staticmethod
+    def apply(deltas: Dict[tuple, int], session=None):
+        operations = [
+            UpdateOne({"day": day, "pickup": pickup, "status": status}, {"$inc": {"count": count}}, upsert=True)
+            for (day, pickup, status), count in deltas.items() if count
+        ]
+        if operations:
+            rollups_collection.bulk_write(operations, ordered=False, session=session)
+    
+    @staticmethod
+    def backfill() -> int:
+        """Rebuild every counter from the rides, server-side; run while rides aren't being written"""
+        rides_collection.aggregate([
+            {"$group": {
+                "_id": {"day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$scheduled_time"}},
+                        "pickup": "$pickup", "status": "$status"},
+                "count": {"$sum": 1}
+            }},
+            {"$project": {"_id": 0, "day": "$_id.day", "pickup": "$_id.pickup", "status": "$_id.status",
+                          "count": 1}},
+            # $out swaps the collection in atomically and keeps its indexes
+            {"$out": rollups_collection.name}
+        ])
+        return rollups_collection.count_documents({})
+    
+    @classmethod
+    def backfill_if_empty(cls):
+        """Build the counters on the first start after an upgrade, when rides exist but rollups don't"""
+        if rollups_collection.find_one({}, {"_id": 1}) is None and rides_collection.find_one({}, {"_id": 1}):
+            print(f"✅ Backfilled {cls.backfill()} ride rollup buckets")
+    
+    @staticmethod
+    def read(start: Optional[date] = None, end: Optional[date] = None) -> dict:
+        """Same shape as ride_analytics, summed from the day buckets in [start, end)"""
+        # Every bucket has a day, so "" bounds an all-time read to the bucket index instead of a COLLSCAN
+        query = {"count": {"$gt": 0}, "day": {"$gte": start.strftime("%Y-%m-%d") if start is not None else ""}}
+        if end is not None:
+            query["day"]["$lt"] = end.strftime("%Y-%m-%d")
+        pickups, statuses = {}, {}
+        for row in rollups_collection.find(query, {"_id": 0, "pickup": 1, "status": 1, "count": 1}):
+            pickups[row["pickup"]] = pickups.get(row["pickup"], 0) + row["count"]
+            statuses[row["status"]] = statuses.get(row["status"], 0) + row["count"]
+        return {
+            "pickups": sorted(pickups.items(), key=lambda item: (-item[1], item[0])),
+            "statuses": statuses
+        }
+
+def update_rides(updates: List[tuple], session=None) -> List[dict]:
+    """Apply (filter, $set) updates one ride at a time; rollups move only for rides that matched"""
+    matched = []
+    deltas = {}
+    for ride_filter, changes in updates:
+        before = rides_collection.find_one_and_update(
+            ride_filter, {"$set": changes},
+            projection={"scheduled_time": 1, "pickup": 1, "status": 1},
+            session=session
         )
+        if before is None:
+            continue  # e.g. started by its driver since it was read
+        matched.append(before)
+        for key, count in RideRollups.moved([before], changes.get("status", before["status"])).items():
+            deltas[key] = deltas.get(key, 0) + count
+    RideRollups.apply(deltas, session)
+    return matched
 
-# Transportation Graph for route optimization
-class TransportationGraph:
-    def __init__(self):
-        self.nodes = {}
-        self.edges = {}
+# Ride state transitions
+class RideStateMachine:
+    """Ride status changes as single atomic updates guarded by the status they leave"""
     
-    def add_node(self, node_id: int, name: str, location: str):
-        self.nodes[node_id] = {"name": name, "location": location}
+    # target status: (statuses it may come from, timestamp field it stamps)
+    TRANSITIONS = {
+        "in_progress": (("scheduled",), "started_at"),
+        "completed": (("in_progress",), "completed_at"),
+    }
     
-    def add_edge(self, from_node: int, to_node: int, weight: int, time: int):
-        if from_node not in self.edges:
-            self.edges[from_node] = {}
-        self.edges[from_node][to_node] = {"weight": weight, "time": time}
+    @classmethod
+    def update_for(cls, target: str) -> tuple:
+        """(status precondition, $set) for a transition into target"""
+        if target not in cls.TRANSITIONS:
+            raise ValueError(f"Rides can't be moved to status {target!r}")
+        sources, stamp = cls.TRANSITIONS[target]
+        return {"$in": list(sources)}, {"status": target, stamp: datetime.now()}
     
-    def dijkstra(self, start: int, end: int) -> tuple:
-        distances = {node: float('inf') for node in self.nodes}
-        previous_nodes = {node: None for node in self.nodes}
-        distances[start] = 0
+    @classmethod
+    def transition(cls, target: str, ride_filter: dict, sort: Optional[list] = None) -> Optional[dict]:
+        """Move the first matching ride into target atomically; the updated document, or None"""
+        precondition, changes = cls.update_for(target)
         
-        priority_queue = [(0, start)]
+        def work(session):
+            # The document as it was tells the rollups which bucket the ride leaves
+            before = rides_collection.find_one_and_update(
+                {**ride_filter, "status": precondition},
+                {"$set": changes},
+                sort=sort,
+                return_document=ReturnDocument.BEFORE,
+                session=session
+            )
+            if before is None:
+                return None
+            RideRollups.apply(RideRollups.moved([before], target), session)
+            return {**before, **changes}
         
-        while priority_queue:
-            current_distance, current_node = heapq.heappop(priority_queue)
-            
-            if current_distance > distances[current_node]:
-                continue
-                
-            if current_node == end:
-                break
-                
-            if current_node in self.edges:
-                for neighbor, edge_data in self.edges[current_node].items():
-                    distance = current_distance + edge_data["weight"]
-                    if distance < distances[neighbor]:
-                        distances[neighbor] = distance
-                        previous_nodes[neighbor] = current_node
-                        heapq.heappush(priority_queue, (distance, neighbor))
+        return run_transaction(work)
+    
+    @classmethod
+    def transition_many(cls, target: str, ride_filter: dict) -> List[dict]:
+        """Move every matching ride into target; returns exactly the documents this call changed"""
+        precondition, changes = cls.update_for(target)
+        # Tag the batch so it can be read back without picking up rides changed by anyone else
+        changes["transition_id"] = ObjectId()
         
-        path = []
-        current = end
-        while current is not None:
-            path.append(current)
-            current = previous_nodes[current]
+        def work(session):
+            before = {doc["_id"]: doc for doc in rides_collection.find(
+                {**ride_filter, "status": precondition},
+                {"scheduled_time": 1, "pickup": 1, "status": 1},
+                session=session
+            )}
+            if not before:
+                return []
+            rides_collection.update_many({"_id": {"$in": list(before)}, "status": precondition},
+                                         {"$set": changes}, session=session)
+            # _id bounds the read-back to the batch via the primary key; transition_id isn't indexed
+            updated = list(rides_collection.find(
+                {"_id": {"$in": list(before)}, "transition_id": changes["transition_id"]}, session=session))
+            RideRollups.apply(RideRollups.moved([before[doc["_id"]] for doc in updated], target), session)
+            return updated
         
-        path.reverse()
-        return path, distances[end]
+        return run_transaction(work)
+
+# Default network
+def create_transport_graph() -> TransportationGraph:
+    """Create a sample transportation graph"""
+    graph = TransportationGraph()
+    
+    locations = {
+        0: "Home (123 Main St)",
+        1: "City General Hospital",
+        2: "City Center Mall",
+        3: "Central Park",
+        4: "City Library",
+        5: "Senior Center",
+        6: "Rehabilitation Center",
+        7: "Medical Clinic"
+    }
+    
+    # (longitude, latitude) of each location
+    coordinates = {
+        0: (-122.4194, 37.7749),
+        1: (-122.4010, 37.7858),
+        2: (-122.4075, 37.7841),
+        3: (-122.4540, 37.7694),
+        4: (-122.4160, 37.7790),
+        5: (-122.3952, 37.7903),
+        6: (-122.3897, 37.7802),
+        7: (-122.4021, 37.7884)
+    }
+    
+    for node_id, name in locations.items():
+        graph.add_node(node_id, name, name, coords=coordinates[node_id])
+    
+    def rush_hour(minutes):
+        """Slower travel in the 7-9am and 4-7pm peaks"""
+        return [(0, minutes), (420, minutes), (480, minutes * 1.6), (570, minutes),
+                (960, minutes), (1050, minutes * 1.5), (1140, minutes)]
+    
+    # Add edges (weights represent travel time in minutes)
+    graph.add_edge(0, 1, 15, 15, rush_hour(15))  # home -> hospital
+    graph.add_edge(0, 2, 10, 10, rush_hour(10))  # home -> mall
+    graph.add_edge(0, 3, 20, 20, rush_hour(20))  # home -> park
+    graph.add_edge(1, 2, 8, 8)    # hospital -> mall
+    graph.add_edge(2, 3, 12, 12)  # mall -> park
+    graph.add_edge(3, 4, 7, 7)    # park -> library
+    graph.add_edge(4, 0, 18, 18, rush_hour(18))  # library -> home
+    graph.add_edge(5, 1, 5, 5)    # senior center -> hospital
+    graph.add_edge(6, 1, 7, 7)    # rehab center -> hospital
+    graph.add_edge(7, 1, 3, 3)    # clinic -> hospital
+    
+    return graph.freeze()
 
 # UI Components
 class ModernButton(ft.ElevatedButton):
@@ -219,45 +3215,34 @@ class AccessibleTransportScheduler:
         self.page.bgcolor = ft.Colors.GREY_100
         
         self.user = None
-        self.transport_graph = self.create_transport_graph()
+        self.background_tasks = set()
+        self.transport_graph = create_transport_graph()
+        self.routing_client = RoutingProviderClient(GOOGLE_MAPS_API_KEY) if GOOGLE_MAPS_API_KEY else None
+        self.load_route_hierarchy()
+        if PRECOMPUTE_ROUTES:
+            self.transport_graph.precompute_routes(ROUTE_CACHE_DIR)
+        start_batch_dispatcher(self.transport_graph)
         
         # Initialize sample data if collections are empty
         self.initialize_sample_data()
+        ensure_indexes()
+        try:
+            RideRollups.backfill_if_empty()
+        except PyMongoError as e:
+            print(f"❌ Could not backfill ride rollups: {e}")
         
         self.setup_ui()
         self.show_login()
     
-    def create_transport_graph(self) -> TransportationGraph:
-        """Create a sample transportation graph"""
-        graph = TransportationGraph()
-        
-        locations = {
-            0: "Home (123 Main St)",
-            1: "City General Hospital",
-            2: "City Center Mall",
-            3: "Central Park",
-            4: "City Library",
-            5: "Senior Center",
-            6: "Rehabilitation Center",
-            7: "Medical Clinic"
-        }
-        
-        for node_id, name in locations.items():
-            graph.add_node(node_id, name, name)
-        
-        # Add edges (weights represent travel time in minutes)
-        graph.add_edge(0, 1, 15, 15)  # home -> hospital
-        graph.add_edge(0, 2, 10, 10)  # home -> mall
-        graph.add_edge(0, 3, 20, 20)  # home -> park
-        graph.add_edge(1, 2, 8, 8)    # hospital -> mall
-        graph.add_edge(2, 3, 12, 12)  # mall -> park
-        graph.add_edge(3, 4, 7, 7)    # park -> library
-        graph.add_edge(4, 0, 18, 18)  # library -> home
-        graph.add_edge(5, 1, 5, 5)    # senior center -> hospital
-        graph.add_edge(6, 1, 7, 7)    # rehab center -> hospital
-        graph.add_edge(7, 1, 3, 3)    # clinic -> hospital
-        
-        return graph
+    def load_route_hierarchy(self):
+        """Load the preprocessed contraction hierarchy, building it if stale or missing"""
+        if not ROUTE_HIERARCHY_PATH:
+            return
+        if self.transport_graph.load_hierarchy(ROUTE_HIERARCHY_PATH):
+            print("✅ Loaded route hierarchy")
+            return
+        self.transport_graph.build_hierarchy().save(ROUTE_HIERARCHY_PATH)
+        print("✅ Built route hierarchy")
     
     def initialize_sample_data(self):
         """Initialize sample data if collections are empty"""
@@ -279,13 +3264,15 @@ class AccessibleTransportScheduler:
                     username="driver1",
                     password_hash=bcrypt.hashpw(b"password123", bcrypt.gensalt()).decode(),
                     vehicle_type="van with wheelchair ramp",
-                    capacity=4
+                    capacity=4,
+                    position=(-122.4194, 37.7749)
                 ).to_dict(),
                 Driver(
                     username="driver2",
                     password_hash=bcrypt.hashpw(b"password123", bcrypt.gensalt()).decode(),
                     vehicle_type="sedan",
-                    capacity=3
+                    capacity=3,
+                    position=(-122.4010, 37.7858)
                 ).to_dict()
             ]
             users_collection.insert_many(users)
@@ -332,6 +3319,7 @@ class AccessibleTransportScheduler:
                 ).to_dict()
             ]
             rides_collection.insert_many(rides)
+            RideRollups.apply(RideRollups.inserted(rides))
     
     def setup_ui(self):
         # Navigation controls
@@ -504,7 +3492,10 @@ class AccessibleTransportScheduler:
         )
         
         # Ride History UI
-        self.history_list = ft.ListView(expand=True, spacing=15)
+        self.history_list = ft.ListView(expand=True, spacing=15, on_scroll=self.on_history_scroll,
+                                        on_scroll_interval=100)
+        self.history_next = None
+        self.history_loading = False
         self.history_view = ft.Column(
             [
                 self.header,
@@ -528,6 +3519,17 @@ class AccessibleTransportScheduler:
         
         # Analytics UI
         self.visualization_image = ft.Image(width=600, height=400, border_radius=10)
+        self.routing_stats = ft.Text(size=12, color=ft.Colors.GREY_700)
+        self.analytics_from = ModernTextField("From (YYYY-MM-DD)", width=190)
+        self.analytics_to = ModernTextField("To (YYYY-MM-DD)", width=190)
+        self.analytics_driver = ft.Dropdown(
+            label="Driver",
+            width=190,
+            options=[ft.dropdown.Option("", "All drivers")],
+            value="",
+            border_radius=10,
+            content_padding=10
+        )
         self.analytics_view = ft.Column(
             [
                 self.header,
@@ -536,7 +3538,10 @@ class AccessibleTransportScheduler:
                     content=ft.Column(
                         [
                             ft.Text("Ride Analytics", size=24, weight=ft.FontWeight.BOLD),
+                            ft.Row([self.analytics_from, self.analytics_to, self.analytics_driver],
+                                   alignment=ft.MainAxisAlignment.CENTER),
                             self.visualization_image,
+                            self.routing_stats,
                             ModernButton("Generate Report", on_click=lambda _: self.generate_analytics())
                         ],
                         horizontal_alignment=ft.CrossAxisAlignment.CENTER,
@@ -554,6 +3559,9 @@ class AccessibleTransportScheduler:
         
         # Driver View
         self.driver_rides = ft.ListView(expand=True, spacing=15)
+        # Rides as listed (route order) and their cards, so transitions can patch single cards
+        self.driver_ride_docs = []
+        self.driver_ride_cards = {}
         self.driver_view = ft.Column(
             [
                 self.header,
@@ -627,6 +3635,7 @@ class AccessibleTransportScheduler:
         self.nav_bar.visible = True
         self.page.clean()
         self.page.add(ft.Column([self.nav_bar, self.analytics_view], spacing=20))
+        self.load_analytics_drivers()
         self.generate_analytics()
         self.page.update()
     
@@ -707,30 +3716,40 @@ class AccessibleTransportScheduler:
             self.user = new_user
             self.show_snackbar("Account created successfully!")
             self.show_scheduler()
+        except DuplicateKeyError:
+            # Lost a race with another registration; the unique index caught it
+            self.show_snackbar("Username already exists")
         except PyMongoError as e:
             self.show_snackbar(f"Failed to create account: {str(e)}")
     
-    def calculate_route(self, pickup: str, dropoff: str) -> tuple:
+    def calculate_route(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
+        """Calculate route, sharing one computation among identical concurrent requests"""
+        key = route_cache.key(pickup, dropoff, "route", departure)
+        return route_flights.do(key, lambda: self.resolve_route(pickup, dropoff, departure))
+    
+    def resolve_route(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
         """Calculate route using Google Maps API or fallback to internal graph"""
         if GOOGLE_MAPS_API_KEY:
-            return self.calculate_route_with_google(pickup, dropoff)
+            return self.calculate_route_with_google(pickup, dropoff, departure)
         else:
-            return self.calculate_route_internal(pickup, dropoff)
+            return self.calculate_route_internal(pickup, dropoff, departure)
     
-    def calculate_route_with_google(self, pickup: str, dropoff: str) -> tuple:
-        """Calculate route using Google Maps API"""
-        url = "https://maps.googleapis.com/maps/api/directions/json"
-        params = {
-            "origin": pickup,
-            "destination": dropoff,
-            "key": GOOGLE_MAPS_API_KEY,
-            "mode": "driving"
-        }
+    def calculate_route_with_google(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
+        """Calculate route using Google Maps API, reusing cached answers"""
+        key = route_cache.key(pickup, dropoff, "driving", departure)
+        try:
+            return route_cache.get_or_compute(
+                key, lambda: self.request_google_route(pickup, dropoff, departure), api=True)
+        except RoutingProviderError as e:
+            # Provider down or circuit open: answer from the internal graph
+            print(f"⚠️ Routing provider unavailable ({e}), using internal graph")
+            return self.calculate_route_internal(pickup, dropoff, departure)
+    
+    def request_google_route(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
+        """Query the Google Directions API"""
+        data = self.routing_client.directions(pickup, dropoff, departure)
         
         try:
-            response = requests.get(url, params=params)
-            data = response.json()
-            
             if data["status"] == "OK":
                 route = data["routes"][0]["legs"][0]
                 distance = route["distance"]["text"]
@@ -744,31 +3763,29 @@ class AccessibleTransportScheduler:
                 return distance_km, duration_min, steps
             else:
                 return None, None, f"Google Maps error: {data['status']}"
-        except Exception as e:
-            return None, None, f"API request failed: {str(e)}"
+        except (KeyError, IndexError, TypeError) as e:
+            return None, None, f"Unexpected API response: {str(e)}"
+    
+    def calculate_route_internal(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
+        """Calculate route using internal graph (fallback), reusing cached answers"""
+        # Keyed by graph contents so edge updates and redeploys never serve stale routes
+        key = route_cache.key(pickup, dropoff, f"internal:{self.transport_graph.fingerprint()[:16]}", departure)
+        return route_cache.get_or_compute(
+            key, lambda: self.compute_route_internal(pickup, dropoff, departure))
     
-    def calculate_route_internal(self, pickup: str, dropoff: str) -> tuple:
-        """Calculate route using internal graph (fallback)"""
+    def compute_route_internal(self, pickup: str, dropoff: str, departure: Optional[datetime] = None) -> tuple:
+        """Route over the internal graph"""
         # Find node IDs for locations
-        node_map = {node["name"]: node_id for node_id, node in self.transport_graph.nodes.items()}
-        
-        start_id = None
-        end_id = None
-        
-        for name, node_id in node_map.items():
-            if pickup in name:
-                start_id = node_id
-            if dropoff in name:
-                end_id = node_id
+        start_id = self.transport_graph.find_location(pickup)
+        end_id = self.transport_graph.find_location(dropoff)
         
         if start_id is None or end_id is None:
             return None, None, "Locations not found in our system"
         
-        # Use Dijkstra's algorithm to find optimal path
-        path, total_time = self.transport_graph.dijkstra(start_id, end_id)
-        
-        # Calculate distance (simplified)
-        distance = total_time * 0.5  # approx 0.5 km per minute
+        # Find optimal path, time-dependent when the ride has a departure time
+        path, total_time, distance = self.transport_graph.quote(start_id, end_id, departure)
+        if total_time == float('inf'):
+            return None, None, "No route between these locations"
         
         # Get human-readable path
         path_names = [self.transport_graph.nodes[node_id]["name"] for node_id in path]
@@ -776,7 +3793,8 @@ class AccessibleTransportScheduler:
         
         return distance, total_time, steps
     
-    def schedule_ride(self, e):
+    async def schedule_ride(self, e):
+        """Schedule a ride without blocking the page; progress is shown in route_info"""
         if not self.user:
             self.show_login()
             return
@@ -797,16 +3815,16 @@ class AccessibleTransportScheduler:
             self.show_snackbar("Invalid date/time format")
             return
         
-        # Calculate route and time
-        distance, duration, steps = self.calculate_route(pickup, dropoff)
+        # Calculate route and time on a worker thread (HTTP or graph search)
+        self.show_route_progress("Calculating route...")
+        distance, duration, steps = await asyncio.to_thread(self.calculate_route, pickup, dropoff, scheduled_time)
         
         if not distance or not duration:
-            self.route_info.value = f"Route calculation failed: {steps}"
-            self.page.update()
+            self.show_route_progress(f"Route calculation failed: {steps}")
             return
         
-        self.route_info.value = f"Route: {distance:.1f} km, Estimated Time: {duration} min"
-        self.page.update()
+        route_text = f"Route: {distance:.1f} km, Estimated Time: {duration} min"
+        self.show_route_progress(f"{route_text} · Finding a driver...")
         
         # Create ride request
         ride_request = RideRequest(
@@ -819,61 +3837,91 @@ class AccessibleTransportScheduler:
             distance=distance
         )
         
-        # Find available driver
-        driver_assigned = False
+        # Driver matching and saving continue in the background
+        task = asyncio.create_task(self.assign_and_save_ride(ride_request, route_text))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+        
+        # Reset form
+        self.accessibility_reqs.value = ""
+        self.page.update()
+    
+    async def assign_and_save_ride(self, ride_request: RideRequest, route_text: str):
         try:
-            drivers = list(drivers_collection.find({"availability": True}))
+            driver_id = await asyncio.to_thread(self.find_driver, ride_request)
         except PyMongoError as e:
             self.show_snackbar(f"Database error: {str(e)}")
+            self.show_route_progress(route_text)
             return
-            
-        for driver_data in drivers:
-            driver = Driver.from_dict(driver_data)
-            
-            # Check if driver meets accessibility requirements
-            if "wheelchair" in ride_request.accessibility_requirements:
-                if "wheelchair ramp" not in driver.vehicle_type.lower():
-                    continue
-            
-            # Assign driver
-            ride_request.driver_id = driver.username
-            ride_request.status = "scheduled"
-            driver_assigned = True
-            break
         
-        if not driver_assigned:
+        if driver_id is None:
             ride_request.status = "pending"
-            self.show_snackbar("No available drivers. Your ride is pending assignment.")
         else:
-            self.show_snackbar(f"Ride scheduled with driver {ride_request.driver_id}!")
+            ride_request.driver_id = driver_id
+            ride_request.status = "scheduled"
         
-        # Save ride to MongoDB
+        self.show_route_progress(f"{route_text} · Saving ride...")
         try:
-            rides_collection.insert_one(ride_request.to_dict())
+            await asyncio.to_thread(self.save_ride, ride_request)
         except PyMongoError as e:
             self.show_snackbar(f"Failed to save ride: {str(e)}")
+            self.show_route_progress(route_text)
             return
         
-        # Reset form
-        self.accessibility_reqs.value = ""
+        if driver_id is None:
+            self.show_snackbar("No available drivers. Your ride is pending assignment.")
+            self.show_route_progress(f"{route_text} · Pending driver assignment")
+        else:
+            self.show_snackbar(f"Ride scheduled with driver {driver_id}!")
+            self.show_route_progress(f"{route_text} · Driver: {driver_id}")
+    
+    def find_driver(self, ride_request: RideRequest) -> Optional[str]:
+        """Capable driver free for the whole trip window; the window is booked on success"""
+        return driver_capabilities.match(ride_request, self.transport_graph)
+    
+    def save_ride(self, ride_request: RideRequest):
+        document = ride_request.to_dict()
+        
+        def work(session):
+            rides_collection.insert_one(document, session=session)
+            RideRollups.apply(RideRollups.inserted([document]), session)
+        
+        run_transaction(work)
+    
+    def show_route_progress(self, message: str):
+        self.route_info.value = message
         self.page.update()
     
     def load_ride_history(self):
+        """Show the first page of the user's rides; later pages load as the list scrolls"""
         self.history_list.controls.clear()
+        self.history_next = None
         
-        try:
-            user_rides = list(rides_collection.find({"user_id": self.user.username}))
-        except PyMongoError as e:
-            self.show_snackbar(f"Database error: {str(e)}")
-            return
-        
-        if not user_rides:
+        if not self.load_history_page() and not self.history_list.controls:
             self.history_list.controls.append(
                 ft.Text("No rides scheduled yet", size=18, color=ft.Colors.GREY)
             )
+    
+    def on_history_scroll(self, e: ft.OnScrollEvent):
+        # Fetch the next page when the user nears the bottom of what is loaded
+        if self.history_next is None or self.history_loading:
             return
+        if e.pixels is not None and e.max_scroll_extent is not None and e.pixels >= e.max_scroll_extent - 300:
+            if self.load_history_page(self.history_next):
+                self.page.update()
+    
+    def load_history_page(self, after: Optional[tuple] = None) -> int:
+        """Append one page of history cards; returns how many were added"""
+        self.history_loading = True
+        try:
+            rides_page, self.history_next = ride_history_page(self.user.username, after)
+        except PyMongoError as e:
+            self.show_snackbar(f"Database error: {str(e)}")
+            return 0
+        finally:
+            self.history_loading = False
         
-        for ride_data in sorted(user_rides, key=lambda r: r["scheduled_time"], reverse=True):
+        for ride_data in rides_page:
             ride = RideRequest.from_dict(ride_data)
             status_color = {
                 "pending": ft.Colors.ORANGE,
@@ -941,9 +3989,12 @@ class AccessibleTransportScheduler:
                     )
                 )
             )
+        return len(rides_page)
     
     def load_driver_rides(self):
         self.driver_rides.controls.clear()
+        self.driver_ride_docs = []
+        self.driver_ride_cards = {}
         
         if not self.user or self.user.role != "driver":
             return
@@ -960,85 +4011,144 @@ class AccessibleTransportScheduler:
             )
             return
         
-        for ride_data in sorted(driver_rides, key=lambda r: r["scheduled_time"]):
-            ride = RideRequest.from_dict(ride_data)
-            status_color = {
-                "scheduled": ft.Colors.BLUE,
-                "in_progress": ft.Colors.PURPLE
-            }.get(ride.status, ft.Colors.BLACK)
-            
-            self.driver_rides.controls.append(
-                ModernCard(
-                    ft.Column(
+        # Rides follow their scheduled time; the day planner's stop order only breaks ties
+        def route_key(ride_data):
+            order = ride_data.get("route_order")
+            return (ride_data["scheduled_time"], order is None, order or 0)
+        
+        self.driver_ride_docs = sorted(driver_rides, key=route_key)
+        for ride_data in self.driver_ride_docs:
+            card = self.driver_ride_card(ride_data)
+            self.driver_ride_cards[ride_data["_id"]] = card
+            self.driver_rides.controls.append(card)
+    
+    def patch_driver_rides(self, updated: List[dict]):
+        """Swap in the cards of rides that just changed instead of re-querying the list"""
+        for ride_data in updated:
+            old = self.driver_ride_cards.get(ride_data["_id"])
+            if old is None:
+                continue
+            card = self.driver_ride_card(ride_data)
+            self.driver_rides.controls[self.driver_rides.controls.index(old)] = card
+            self.driver_ride_cards[ride_data["_id"]] = card
+            self.driver_ride_docs = [ride_data if doc["_id"] == ride_data["_id"] else doc
+                                     for doc in self.driver_ride_docs]
+    
+    def driver_ride_card(self, ride_data: dict) -> ModernCard:
+        ride = RideRequest.from_dict(ride_data)
+        status_color = {
+            "scheduled": ft.Colors.BLUE,
+            "in_progress": ft.Colors.PURPLE
+        }.get(ride.status, ft.Colors.BLACK)
+        
+        return ModernCard(
+            ft.Column(
+                [
+                    ft.Row(
                         [
-                            ft.Row(
+                            ft.Text(f"{ride.pickup} → {ride.dropoff}", 
+                                    size=18, weight=ft.FontWeight.BOLD),
+                            ft.Container(
+                                ft.Text(ride.status.upper(), color=ft.Colors.WHITE, size=12),
+                                padding=ft.padding.symmetric(5, 10),
+                                bgcolor=status_color,
+                                border_radius=10
+                            )
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                    ),
+                    ft.Divider(height=10),
+                    ft.Row(
+                        [
+                            ft.Column(
                                 [
-                                    ft.Text(f"{ride.pickup} → {ride.dropoff}", 
-                                            size=18, weight=ft.FontWeight.BOLD),
-                                    ft.Container(
-                                        ft.Text(ride.status.upper(), color=ft.Colors.WHITE, size=12),
-                                        padding=ft.padding.symmetric(5, 10),
-                                        bgcolor=status_color,
-                                        border_radius=10
-                                    )
+                                    ft.Text("PASSENGER", size=12, color=ft.Colors.GREY),
+                                    ft.Text(ride.user_id)
                                 ],
-                                alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                                spacing=2
                             ),
-                            ft.Divider(height=10),
-                            ft.Row(
+                            ft.Column(
                                 [
-                                    ft.Column(
-                                        [
-                                            ft.Text("PASSENGER", size=12, color=ft.Colors.GREY),
-                                            ft.Text(ride.user_id)
-                                        ],
-                                        spacing=2
-                                    ),
-                                    ft.Column(
-                                        [
-                                            ft.Text("TIME", size=12, color=ft.Colors.GREY),
-                                            ft.Text(ride.scheduled_time.strftime("%b %d, %Y %H:%M"))
-                                        ],
-                                        spacing=2
-                                    ),
-                                    ft.Column(
-                                        [
-                                            ft.Text("DURATION", size=12, color=ft.Colors.GREY),
-                                            ft.Text(f"{ride.estimated_time} min")
-                                        ],
-                                        spacing=2
-                                    )
+                                    ft.Text("TIME", size=12, color=ft.Colors.GREY),
+                                    ft.Text(ride.scheduled_time.strftime("%b %d, %Y %H:%M"))
                                 ],
-                                alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                                spacing=2
                             ),
-                            ft.Divider(height=10),
-                            ft.Text("Requirements: " + ", ".join(ride.accessibility_requirements) 
-                                   or "No special requirements")
-                        ]
-                    )
-                )
+                            ft.Column(
+                                [
+                                    ft.Text("DURATION", size=12, color=ft.Colors.GREY),
+                                    ft.Text(f"{ride.estimated_time} min")
+                                ],
+                                spacing=2
+                            ),
+                            ft.Column(
+                                [
+                                    ft.Text("STOP", size=12, color=ft.Colors.GREY),
+                                    ft.Text("-" if ride.route_order is None else f"#{ride.route_order + 1}")
+                                ],
+                                spacing=2
+                            )
+                        ],
+                        alignment=ft.MainAxisAlignment.SPACE_BETWEEN
+                    ),
+                    ft.Divider(height=10),
+                    ft.Text("Requirements: " + ", ".join(ride.accessibility_requirements) 
+                           or "No special requirements")
+                ]
             )
+        )
+    
+    def move_driver_to(self, location: str):
+        """Record the signed-in driver at a network location (pickup on start, dropoff on completion)"""
+        node_id = self.transport_graph.find_location(location)
+        if node_id is None or self.transport_graph.nodes[node_id]["coords"] is None:
+            return
+        node = self.transport_graph.nodes[node_id]
+        driver_locator.update_position(self.user.username, node["coords"], node["name"])
+    
+    def next_driver_ride(self, status: str) -> Optional[dict]:
+        """First ride in the driver's listed order with the given status"""
+        ride_data = next((doc for doc in self.driver_ride_docs if doc["status"] == status), None)
+        if ride_data is None:
+            # The list may predate a change made on another device
+            self.load_driver_rides()
+            ride_data = next((doc for doc in self.driver_ride_docs if doc["status"] == status), None)
+        return ride_data
     
     def mark_completed(self, e):
         if not self.user or self.user.role != "driver":
             return
         
+        ride_data = self.next_driver_ride("in_progress")
+        if ride_data is None:
+            self.show_snackbar("No rides in progress to mark as completed")
+            self.page.update()
+            return
+        
         try:
-            # Find the first scheduled ride for this driver
-            ride_data = rides_collection.find_one({
-                "driver_id": self.user.username,
-                "status": "scheduled"
-            })
-            
-            if ride_data:
-                rides_collection.update_one(
-                    {"_id": ride_data["_id"]},
-                    {"$set": {"status": "completed"}}
-                )
-                self.show_snackbar("Ride marked as completed!")
+            # Status precondition: a second tap or device finds nothing left to complete
+            updated = RideStateMachine.transition(
+                "completed", {"_id": ride_data["_id"], "driver_id": self.user.username}
+            )
+            if updated is None:
+                self.show_snackbar("This ride was already completed")
                 self.load_driver_rides()
-            else:
-                self.show_snackbar("No scheduled rides to mark as completed")
+                self.page.update()
+                return
+            
+            changed = [updated]
+            if updated.get("pool_id"):
+                # Riders sharing the trip who get off at the same stop finish together
+                changed += RideStateMachine.transition_many("completed", {
+                    "driver_id": self.user.username,
+                    "pool_id": updated["pool_id"],
+                    "dropoff": updated["dropoff"]
+                })
+            self.move_driver_to(updated["dropoff"])
+            self.patch_driver_rides(changed)
+            self.show_snackbar("Ride marked as completed!" if len(changed) == 1
+                               else f"{len(changed)} rides marked as completed!")
+            self.page.update()
         except PyMongoError as e:
             self.show_snackbar(f"Database error: {str(e)}")
     
@@ -1046,50 +4156,84 @@ class AccessibleTransportScheduler:
         if not self.user or self.user.role != "driver":
             return
         
+        ride_data = self.next_driver_ride("scheduled")
+        if ride_data is None:
+            self.show_snackbar("No scheduled rides to start")
+            self.page.update()
+            return
+        
         try:
-            # Find the first scheduled ride for this driver
-            ride_data = rides_collection.find_one({
-                "driver_id": self.user.username,
-                "status": "scheduled"
-            })
-            
-            if ride_data:
-                rides_collection.update_one(
-                    {"_id": ride_data["_id"]},
-                    {"$set": {"status": "in_progress"}}
-                )
-                self.show_snackbar("Ride started!")
+            updated = RideStateMachine.transition(
+                "in_progress", {"_id": ride_data["_id"], "driver_id": self.user.username}
+            )
+            if updated is None:
+                self.show_snackbar("This ride was already started or changed")
                 self.load_driver_rides()
-            else:
-                self.show_snackbar("No scheduled rides to start")
+                self.page.update()
+                return
+            
+            self.move_driver_to(updated["pickup"])
+            self.patch_driver_rides([updated])
+            self.show_snackbar("Ride started!")
+            self.page.update()
+        except PyMongoError as e:
+            self.show_snackbar(f"Database error: {str(e)}")
+    
+    def load_analytics_drivers(self):
+        """Fill the driver filter from the drivers collection"""
+        try:
+            usernames = sorted(d["username"] for d in drivers_collection.find({}, {"username": 1}))
         except PyMongoError as e:
             self.show_snackbar(f"Database error: {str(e)}")
+            return
+        self.analytics_driver.options = [ft.dropdown.Option("", "All drivers")] + [
+            ft.dropdown.Option(username) for username in usernames
+        ]
+    
+    def show_routing_stats(self):
+        """Route cache and request coalescing counters since startup"""
+        cache = route_cache.stats()
+        flights = route_flights.stats()
+        self.routing_stats.value = (
+            f"Route cache: {cache['hit_rate']:.0%} hits ({cache['memory_hits']} memory, "
+            f"{cache['disk_hits']} disk, {cache['misses']} misses), saved ~{cache['avoided_seconds']:.1f} s "
+            f"and {cache['avoided_api_calls']} API calls. "
+            f"Coalesced {flights['coalesced']} of {flights['calls']} route requests."
+        )
     
     def generate_analytics(self):
+        self.show_routing_stats()
+        try:
+            start = datetime.strptime(self.analytics_from.value, "%Y-%m-%d") if self.analytics_from.value else None
+            # The "to" date is inclusive
+            end = (datetime.strptime(self.analytics_to.value, "%Y-%m-%d") + timedelta(days=1)
+                   if self.analytics_to.value else None)
+        except ValueError:
+            self.show_snackbar("Invalid date format")
+            return
+        
         try:
-            all_rides = list(rides_collection.find())
+            # Day rollups answer the common case; per-driver reports aggregate the rides themselves
+            if self.analytics_driver.value:
+                counts = ride_analytics(start, end, self.analytics_driver.value)
+            else:
+                counts = RideRollups.read(start.date() if start else None, end.date() if end else None)
         except PyMongoError as e:
             self.show_snackbar(f"Database error: {str(e)}")
             return
             
-        if not all_rides:
+        if not counts["pickups"]:
             self.visualization_image.src = None
+            self.visualization_image.src_base64 = None
             self.page.update()
             return
             
         # Create plots
         fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 6))
         
-        # Plot 1: Ride frequency by location
-        locations = [ride["pickup"] for ride in all_rides]
-        location_counts = {}
-        for loc in locations:
-            location_counts[loc] = location_counts.get(loc, 0) + 1
-        
-        # Sort locations by frequency
-        sorted_locations = sorted(location_counts.items(), key=lambda x: x[1], reverse=True)
-        loc_names = [loc[0] for loc in sorted_locations]
-        loc_counts = [loc[1] for loc in sorted_locations]
+        # Plot 1: Ride frequency by location (already sorted by frequency)
+        loc_names = [loc[0] for loc in counts["pickups"]]
+        loc_counts = [loc[1] for loc in counts["pickups"]]
         
         ax1.bar(loc_names, loc_counts, color='#4285F4')
         ax1.set_title('Ride Frequency by Location')
@@ -1098,9 +4242,7 @@ class AccessibleTransportScheduler:
         ax1.tick_params(axis='x', rotation=45)
         
         # Plot 2: Ride status distribution
-        status_counts = {}
-        for ride in all_rides:
-            status_counts[ride["status"]] = status_counts.get(ride["status"], 0) + 1
+        status_counts = counts["statuses"]
         
         status_names = list(status_counts.keys())
         status_values = list(status_counts.values())
@@ -1143,9 +4285,301 @@ class AccessibleTransportScheduler:
         self.show_login()
         self.show_snackbar("You have been logged out")
 
+# Bulk ride import
+def bulk_import_rides(csv_path: str, graph: Optional[TransportationGraph] = None,
+                      chunk_size: int = 500) -> dict:
+    """Stream a CSV of rides, quote each distinct route and departure once, and insert_many them
+    
+    Columns: user_id, pickup, dropoff, scheduled_time (YYYY-MM-DD HH:MM) and
+    optional accessibility_requirements (comma separated).
+    """
+    graph = graph or create_transport_graph()
+    stats = {"rows": 0, "inserted": 0, "pending": 0, "rejected": 0, "unknown_locations": {}}
+    started = perf_counter()
+    
+    # Quotes follow rush-hour profiles like an interactive booking, so they are shared per
+    # (pickup, dropoff, departure minute) rather than per pair
+    quotes = {}
+    
+    def flush(chunk):
+        # Resolve locations once per distinct name
+        resolved = {}
+        for row in chunk:
+            for name in (row["pickup"], row["dropoff"]):
+                if name not in resolved:
+                    resolved[name] = graph.find_location(name)
+        
+        documents = []
+        for row in chunk:
+            start_id, end_id = resolved[row["pickup"]], resolved[row["dropoff"]]
+            try:
+                scheduled_time = datetime.strptime(row["scheduled_time"].strip(), "%Y-%m-%d %H:%M")
+            except (ValueError, AttributeError):
+                stats["rejected"] += 1
+                continue
+            if start_id is None or end_id is None:
+                # Never guess a landmark; list close names so the file can be corrected
+                for name, node_id in ((row["pickup"], start_id), (row["dropoff"], end_id)):
+                    if node_id is None and name not in stats["unknown_locations"]:
+                        stats["unknown_locations"][name] = [
+                            graph.nodes[suggestion]["name"] for suggestion in graph.suggest_location(name)]
+                stats["rejected"] += 1
+                continue
+            key = (start_id, end_id, scheduled_time)
+            if key not in quotes:
+                quotes[key] = graph.quote(start_id, end_id, scheduled_time)[1:]
+            duration, distance = quotes[key]
+            if not math.isfinite(duration) or duration == 0:
+                stats["rejected"] += 1
+                continue
+            
+            requirements = row.get("accessibility_requirements") or ""
+            ride_request = RideRequest(
+                user_id=row["user_id"],
+                pickup=row["pickup"],
+                dropoff=row["dropoff"],
+                scheduled_time=scheduled_time,
+                accessibility_requirements=[r.strip() for r in requirements.split(",") if r.strip()],
+                estimated_time=duration,
+                distance=distance
+            )
+            driver_id = driver_capabilities.match(ride_request, graph)
+            if driver_id is None:
+                stats["pending"] += 1
+            else:
+                ride_request.driver_id = driver_id
+                ride_request.status = "scheduled"
+            documents.append(ride_request.to_dict())
+        
+        if documents:
+            def work(session):
+                rides_collection.insert_many(documents, ordered=False, session=session)
+                RideRollups.apply(RideRollups.inserted(documents), session)
+            
+            run_transaction(work)
+            stats["inserted"] += len(documents)
+        elapsed = perf_counter() - started
+        print(f"  {stats['rows']} rows, {stats['inserted']} inserted, "
+              f"{stats['rows'] / elapsed:.0f} rides/s")
+    
+    with open(csv_path, newline="", encoding="utf-8") as f:
+        chunk = []
+        for row in csv.DictReader(f):
+            stats["rows"] += 1
+            # Short rows leave missing columns as None; reject them here rather than mid-chunk
+            if any(not isinstance(row.get(column), str) or not row[column].strip()
+                   for column in ("user_id", "pickup", "dropoff", "scheduled_time")):
+                stats["rejected"] += 1
+                continue
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                flush(chunk)
+                chunk = []
+        if chunk:
+            flush(chunk)
+    
+    stats["seconds"] = perf_counter() - started
+    stats["rides_per_second"] = stats["rows"] / stats["seconds"] if stats["seconds"] else 0.0
+    return stats
+
+# Routing benchmarks
+def generate_grid_graph(rows: int, cols: int, seed: int = 0) -> TransportationGraph:
+    """Grid of intersections with random two-way block travel times"""
+    rng = random.Random(seed)
+    graph = TransportationGraph()
+    for r in range(rows):
+        for c in range(cols):
+            node_id = r * cols + c
+            graph.add_node(node_id, f"Grid {r},{c}", f"{r},{c}", coords=(c, r))
+    
+    for r in range(rows):
+        for c in range(cols):
+            node_id = r * cols + c
+            for neighbor in ((node_id + 1) if c + 1 < cols else None,
+                             (node_id + cols) if r + 1 < rows else None):
+                if neighbor is not None:
+                    minutes = rng.randint(5, 10)
+                    graph.add_edge(node_id, neighbor, minutes, minutes)
+                    graph.add_edge(neighbor, node_id, minutes, minutes)
+    
+    return graph.freeze()
+
+def generate_road_graph(size: int, seed: int = 0) -> TransportationGraph:
+    """Jittered street grid with missing blocks and faster arterial roads"""
+    rng = random.Random(seed)
+    graph = TransportationGraph()
+    for r in range(size):
+        for c in range(size):
+            graph.add_node(r * size + c, f"Road {r},{c}", f"{r},{c}",
+                           coords=(c + rng.uniform(-0.3, 0.3), r + rng.uniform(-0.3, 0.3)))
+    
+    def connect(a, b, speed):
+        ax, ay = graph.nodes[a]["coords"]
+        bx, by = graph.nodes[b]["coords"]
+        minutes = max(1, math.ceil(math.hypot(ax - bx, ay - by) * 10 / speed))
+        graph.add_edge(a, b, minutes, minutes)
+        graph.add_edge(b, a, minutes, minutes)
+    
+    for r in range(size):
+        for c in range(size):
+            node_id = r * size + c
+            arterial = r % 8 == 0 or c % 8 == 0
+            if c + 1 < size and (arterial or rng.random() > 0.15):
+                connect(node_id, node_id + 1, 3.0 if r % 8 == 0 else rng.uniform(0.8, 1.2))
+            if r + 1 < size and (arterial or rng.random() > 0.15):
+                connect(node_id, node_id + size, 3.0 if c % 8 == 0 else rng.uniform(0.8, 1.2))
+    
+    return graph.freeze()
+
+def benchmark_shortest_path(graph: TransportationGraph, queries: int = 50, seed: int = 0) -> Dict[str, dict]:
+    """Compare settled nodes and wall time of each search on random queries"""
+    rng = random.Random(seed)
+    pairs = [(rng.choice(graph.node_ids), rng.choice(graph.node_ids)) for _ in range(queries)]
+    results = {}
+    
+    # Preprocessing is offline, so keep it out of the query timings
+    if graph.hierarchy is None:
+        graph.build_hierarchy()
+    
+    for algorithm in ("dijkstra", "astar", "bidirectional", "ch"):
+        settled = 0
+        started = perf_counter()
+        for start, end in pairs:
+            graph.shortest_path(start, end, algorithm)
+            settled += graph.last_settled
+        elapsed = perf_counter() - started
+        results[algorithm] = {
+            "settled": settled / queries,
+            "ms_per_query": elapsed * 1000 / queries
+        }
+    
+    return results
+
+def benchmark_k_shortest_paths(graph: TransportationGraph, k: int = 3, queries: int = 20,
+                               seed: int = 0) -> Dict[str, dict]:
+    """Compare Yen with a reused shortest-path tree against naive per-spur Dijkstra"""
+    rng = random.Random(seed)
+    pairs = [(rng.choice(graph.node_ids), rng.choice(graph.node_ids)) for _ in range(queries)]
+    results = {}
+    
+    for label, reuse_tree in (("naive", False), ("tree reuse", True)):
+        settled = 0
+        started = perf_counter()
+        for start, end in pairs:
+            graph.k_shortest_paths(start, end, k, reuse_tree=reuse_tree)
+            settled += graph.last_settled
+        elapsed = perf_counter() - started
+        results[label] = {
+            "settled": settled / queries,
+            "ms_per_query": elapsed * 1000 / queries
+        }
+    
+    return results
+
+def benchmark_assignment(sizes=(500, 1000, 2000, 5000), seed: int = 0) -> Dict[int, float]:
+    """Seconds to solve random n x n driver/ride assignments with 10% infeasible pairs"""
+    rng = np.random.default_rng(seed)
+    results = {}
+    for n in sizes:
+        cost = rng.uniform(1, 60, size=(n, n))
+        cost[rng.random((n, n)) < 0.1] = BatchDispatcher.INFEASIBLE
+        started = perf_counter()
+        solve_assignment(cost)
+        results[n] = perf_counter() - started
+    return results
+
+def benchmark_pooling(graph: TransportationGraph, rides: int = 1000, capacity: int = 4,
+                      seed: int = 0) -> Dict[str, float]:
+    """Plan time (cold and with cached distance rows) and vehicle minutes saved on random rides"""
+    rng = random.Random(seed)
+    start = datetime(2025, 1, 6, 8)
+    names = [graph.nodes[node_id]["name"] for node_id in graph.node_ids]
+    trips = [RideRequest("", rng.choice(names), rng.choice(names),
+                             start + timedelta(minutes=rng.uniform(0, 120)))
+                 for _ in range(rides)]
+    engine = PoolingEngine(graph)
+    
+    started = perf_counter()
+    engine.plan(trips, capacity)
+    cold = perf_counter() - started
+    started = perf_counter()
+    pools = engine.plan(trips, capacity)
+    warm = perf_counter() - started
+    
+    rows, node_index = engine.rows, graph.node_index
+    solo = sum(rows[graph.find_location(r.pickup)][node_index[graph.find_location(r.dropoff)]] for r in trips)
+    pooled = sum(sum(rows[a[2]][node_index[b[2]]] for a, b in zip(pool.stops, pool.stops[1:])) for pool in pools)
+    return {"cold_s": cold, "replan_s": warm, "pools": len(pools), "saved": float(1 - pooled / solo)}
+
+def run_benchmarks():
+    graphs = {
+        "grid 150x150": generate_grid_graph(150, 150),
+        "road 150x150": generate_road_graph(150),
+    }
+    for label, graph in graphs.items():
+        print(f"{label}: {len(graph.node_ids)} nodes, {len(graph.targets)} edges")
+        for algorithm, stats in benchmark_shortest_path(graph).items():
+            print(f"  {algorithm:<14} settled {stats['settled']:>10.0f}   {stats['ms_per_query']:8.2f} ms/query")
+    
+    # Naive Yen is too slow for the large graphs above
+    for label, graph in (("grid 40x40", generate_grid_graph(40, 40)), ("road 40x40", generate_road_graph(40))):
+        print(f"{label}: k=3 alternative routes")
+        for variant, stats in benchmark_k_shortest_paths(graph).items():
+            print(f"  {variant:<14} settled {stats['settled']:>10.0f}   {stats['ms_per_query']:8.2f} ms/query")
+    
+    solver = "scipy" if linear_sum_assignment is not None else "numpy Hungarian"
+    print(f"driver assignment ({solver})")
+    for n, seconds in benchmark_assignment().items():
+        print(f"  {n}x{n} {seconds:10.2f} s")
+    
+    stats = benchmark_pooling(generate_grid_graph(40, 40))
+    print(f"ride pooling (1000 rides, grid 40x40): {stats['cold_s']:.2f} s cold, {stats['replan_s']:.2f} s replan, "
+          f"{stats['pools']} trips, {stats['saved']:.0%} vehicle minutes saved")
+
 def main(page: ft.Page):
     app = AccessibleTransportScheduler(page)
     page.update()
 
 if __name__ == "__main__":
-    ft.app(target=main)
\ No newline at end of file
+    if "--benchmark" in sys.argv:
+        run_benchmarks()
+    elif "--import-rides" in sys.argv:
+        # Headless bulk import: python "ATS(Tamayo).py" --import-rides rides.csv
+        stats = bulk_import_rides(sys.argv[sys.argv.index("--import-rides") + 1])
+        print(f"✅ Imported {stats['inserted']} of {stats['rows']} rides "
+              f"({stats['pending']} pending, {stats['rejected']} rejected) "
+              f"at {stats['rides_per_second']:.0f} rides/s")
+        for name, suggestions in stats["unknown_locations"].items():
+            hint = f" (did you mean {' or '.join(suggestions)}?)" if suggestions else ""
+            print(f"❌ Unknown location '{name}'{hint}")
+    elif "--dispatch" in sys.argv:
+        # One batch dispatch pass: python "ATS(Tamayo).py" --dispatch
+        print(f"✅ Dispatcher assigned {BatchDispatcher(create_transport_graph()).dispatch()} rides")
+    elif "--plan-day" in sys.argv:
+        # Offline day planning: python "ATS(Tamayo).py" --plan-day [YYYY-MM-DD] (default tomorrow)
+        args = sys.argv[sys.argv.index("--plan-day") + 1:]
+        day = datetime.strptime(args[0], "%Y-%m-%d").date() if args else None
+        stats = DayPlanner(create_transport_graph(), processes=os.cpu_count()).plan_day(day)
+        print(f"✅ Planned {stats['rides'] - len(stats['unplanned'])} of {stats['rides']} rides "
+              f"across {stats['drivers']} drivers")
+        for ride_id in stats["unplanned"]:
+            print(f"❌ Ride {ride_id} could not be placed in a route; it keeps its current driver")
+    elif "--check-indexes" in sys.argv:
+        # Query-plan check: python "ATS(Tamayo).py" --check-indexes (exits 1 on any collection scan)
+        ensure_indexes()
+        plans = check_query_plans()
+        for label, index_name in plans.items():
+            print(f"{'✅' if index_name else '❌'} {label}: {f'IXSCAN {index_name}' if index_name else 'COLLSCAN'}")
+        sys.exit(0 if all(plans.values()) else 1)
+    elif "--backfill-rollups" in sys.argv:
+        # Rebuild analytics rollups from the rides: python "ATS(Tamayo).py" --backfill-rollups
+        RideRollups.ensure_indexes()
+        print(f"✅ Rebuilt {RideRollups.backfill()} ride rollup buckets")
+    elif "--build-hierarchy" in sys.argv:
+        # Offline preprocessing: python "ATS(Tamayo).py" --build-hierarchy [PATH]
+        args = sys.argv[sys.argv.index("--build-hierarchy") + 1:]
+        path = args[0] if args else ROUTE_HIERARCHY_PATH or "route_hierarchy.pkl"
+        create_transport_graph().build_hierarchy().save(path)
+        print(f"✅ Route hierarchy written to {path}")
+    else:
+        ft.app(target=main)
\ No newline at end of file
@@ -0,0 +1,176 @@
+"""The app's history, dashboard and schedule queries never fall back to a collection scan
+
+Runs the real query functions against a local mongod (skipped when none is reachable),
+records every read they send, and explains each one.
+"""
+import importlib.util
+import os
+from datetime import datetime, timedelta
+
+import pytest
+from pymongo import monitoring
+from pymongo.errors import PyMongoError
+
+# Importing the app pings MongoDB; don't wait 30s when no server is running
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/?serverSelectionTimeoutMS=500")
+
+TEST_DB = "accessible_transport_query_plans"
+EXPLAINABLE = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+# Session and transaction fields the driver adds; explain rejects them
+DRIVER_FIELDS = {"lsid", "txnNumber", "autocommit", "startTransaction", "readConcern", "writeConcern",
+                 "$db", "$clusterTime", "$readPreference"}
+
+
+class CommandRecorder(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.database_name == TEST_DB and event.command_name in EXPLAINABLE:
+            self.commands.append(dict(event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Registered before the app creates its client, so every command it sends is seen
+recorder = CommandRecorder()
+monitoring.register(recorder)
+
+spec = importlib.util.spec_from_file_location(
+    "ats", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ATS(Tamayo).py"))
+ats = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ats)
+
+
+def winning_plans(explain):
+    """Every winningPlan in an explain() result, including each $cursor stage of an aggregation"""
+    if isinstance(explain, dict):
+        for key, value in explain.items():
+            if key == "winningPlan":
+                yield value
+            elif key != "rejectedPlans":
+                yield from winning_plans(value)
+    elif isinstance(explain, list):
+        for item in explain:
+            yield from winning_plans(item)
+
+
+def explain(database, command):
+    """explain() of one recorded command, one statement at a time for batched writes"""
+    command = {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+    batches = {"update": "updates", "delete": "deletes"}
+    name = next(iter(command))
+    if name in batches:
+        field = batches[name]
+        return [database.command("explain", {**command, field: [statement]}, verbosity="queryPlanner")
+                for statement in command[field]]
+    return [database.command("explain", command, verbosity="queryPlanner")]
+
+
+def assert_no_collection_scans(database):
+    assert recorder.commands, "no queries were recorded"
+    for command in recorder.commands:
+        for result in explain(database, command):
+            plans = list(winning_plans(result))
+            assert plans, f"no winning plan for {command}"
+            for plan in plans:
+                assert ats.find_stage(plan, "COLLSCAN") is None, f"COLLSCAN in {command}: {plan}"
+
+
+@pytest.fixture(scope="module")
+def database():
+    try:
+        ats.client.admin.command("ping")
+    except PyMongoError:
+        pytest.skip("needs a local mongod (set MONGO_URI)")
+
+    # Point the app at a scratch database so real data is never touched
+    ats.client.drop_database(TEST_DB)
+    ats.db = ats.client[TEST_DB]
+    ats.users_collection = ats.db["users"]
+    ats.rides_collection = ats.db["rides"]
+    ats.drivers_collection = ats.db["drivers"]
+    ats.rollups_collection = ats.db["ride_rollups"]
+    ats.QUERY_INDEXES = [(ats.db[collection.name], keys, options)
+                         for collection, keys, options in ats.QUERY_INDEXES]
+    ats.ensure_indexes()
+
+    ats.drivers_collection.insert_many([
+        ats.Driver("driver1", "x", role="driver", vehicle_type="van with wheelchair ramp", capacity=4,
+                   current_location="Home (123 Main St)", position=(-122.4194, 37.7749)).to_dict(),
+        ats.Driver("driver2", "x", role="driver", vehicle_type="sedan", capacity=3,
+                   current_location="City Center Mall", position=(-122.4075, 37.7841)).to_dict(),
+    ])
+    tomorrow = datetime.combine((datetime.now() + timedelta(days=1)).date(), datetime.min.time())
+    rides = []
+    for i in range(60):
+        status = ("pending", "scheduled", "in_progress", "completed")[i % 4]
+        rides.append(ats.RideRequest(
+            user_id=f"user{i % 3}",
+            pickup=("Home (123 Main St)", "City General Hospital", "City Center Mall")[i % 3],
+            dropoff="Central Park",
+            scheduled_time=tomorrow + timedelta(hours=6 + i % 12, minutes=i),
+            status=status,
+            driver_id=None if status == "pending" else f"driver{1 + i % 2}",
+            estimated_time=20
+        ).to_dict())
+    ats.rides_collection.insert_many(rides)
+    ats.RideRollups.apply(ats.RideRollups.inserted(rides))
+
+    yield ats.db
+    ats.client.drop_database(TEST_DB)
+
+
+@pytest.fixture
+def recorded(database):
+    recorder.commands.clear()
+    yield database
+    recorder.commands.clear()
+
+
+def test_history_queries(recorded):
+    page, after = ats.ride_history_page("user0")
+    assert after is not None
+    ats.ride_history_page("user0", after)
+    assert_no_collection_scans(recorded)
+
+
+def test_dashboard_queries(recorded):
+    start = datetime.now()
+    end = start + timedelta(days=2)
+    ats.RideRollups.read()
+    ats.RideRollups.read(start.date(), end.date())
+    ats.ride_analytics(driver_id="driver1")
+    ats.ride_analytics(start, end, "driver1")
+    assert_no_collection_scans(recorded)
+
+
+def test_schedule_queries(recorded):
+    graph = ats.create_transport_graph()
+    ats.driver_schedule.refresh()
+    ats.driver_capabilities.refresh()
+    ats.driver_locator.refresh()
+    ats.BatchDispatcher(graph).dispatch()
+    ats.DayPlanner(graph, restarts=1).plan_day()
+    ride = ats.RideStateMachine.transition("in_progress", {"driver_id": "driver1"}, sort=[("scheduled_time", 1)])
+    assert ride is not None
+    ats.RideStateMachine.transition("completed", {"_id": ride["_id"], "driver_id": "driver1"})
+    ats.RideStateMachine.transition_many("completed", {"driver_id": "driver2", "dropoff": "Central Park"})
+    assert_no_collection_scans(recorded)
+
+
+def test_check_query_plans_passes(database):
+    assert all(ats.check_query_plans().values())
+
+
+def test_or_branch_collection_scan_fails_check():
+    index_branch = {"stage": "FETCH", "inputStage": {"stage": "IXSCAN", "indexName": "ride_status"}}
+    plan = {"stage": "SUBPLAN", "inputStage": {"stage": "OR", "inputStages": [index_branch, {"stage": "COLLSCAN"}]}}
+    assert ats.scanned_index(plan) is None
+    plan["inputStage"]["inputStages"][1] = index_branch
+    assert ats.scanned_index(plan) == "ride_status"
+    assert ats.scanned_index({"stage": "COLLSCAN"}) is None
@@ -0,0 +1,85 @@
+"""Contraction hierarchy routes checked against plain Dijkstra"""
+import importlib.util
+import math
+import os
+import random
+
+import pytest
+
+# Importing the app pings MongoDB; don't wait 30s for a server the routing code never uses
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/?serverSelectionTimeoutMS=100")
+
+spec = importlib.util.spec_from_file_location(
+    "ats", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ATS(Tamayo).py"))
+ats = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ats)
+
+
+def random_graph(seed: int, nodes: int = 60, edges: int = 180):
+    """Random directed graph mixing integer and float weights; some pairs are unreachable"""
+    rng = random.Random(seed)
+    graph = ats.TransportationGraph()
+    for node_id in range(nodes):
+        graph.add_node(node_id, f"Stop {node_id}", f"Stop {node_id}", coords=(rng.random(), rng.random()))
+    for _ in range(edges):
+        u, v = rng.sample(range(nodes), 2)
+        weight = rng.randint(1, 30) if rng.random() < 0.5 else rng.uniform(0.5, 30)
+        graph.add_edge(u, v, weight, weight)
+    return graph.freeze()
+
+
+def path_cost(graph, path):
+    return sum(graph.edges[u][v]["weight"] for u, v in zip(path, path[1:]))
+
+
+def assert_same_route(graph, start, end, path, distance):
+    _, expected = graph.dijkstra(start, end)
+    if expected == float('inf'):
+        assert distance == float('inf')
+        return
+    assert distance == pytest.approx(expected)
+    # The unpacked path must be a real route of that length, not just the right number
+    assert path[0] == start and path[-1] == end
+    assert path_cost(graph, path) == pytest.approx(expected)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_ch_matches_dijkstra(seed):
+    graph = random_graph(seed)
+    rng = random.Random(seed)
+    for _ in range(200):
+        start, end = rng.randrange(60), rng.randrange(60)
+        path, distance = graph.shortest_path(start, end, "ch")
+        assert_same_route(graph, start, end, path, distance)
+
+
+def test_ch_same_node():
+    graph = random_graph(0)
+    assert graph.shortest_path(7, 7, "ch") == ([7], 0)
+
+
+def test_ch_save_load_round_trip(tmp_path):
+    path = str(tmp_path / "hierarchy.pkl")
+    graph = random_graph(11)
+    graph.build_hierarchy().save(path)
+
+    reloaded = random_graph(11)
+    assert reloaded.load_hierarchy(path)
+    rng = random.Random(11)
+    for _ in range(200):
+        start, end = rng.randrange(60), rng.randrange(60)
+        path_nodes, distance = reloaded.shortest_path(start, end, "ch")
+        assert_same_route(reloaded, start, end, path_nodes, distance)
+        assert (path_nodes, distance) == graph.shortest_path(start, end, "ch")
+
+
+def test_ch_load_rejects_other_graph(tmp_path):
+    path = str(tmp_path / "hierarchy.pkl")
+    random_graph(11).build_hierarchy().save(path)
+
+    changed = random_graph(11)
+    changed.add_edge(0, 1, 1, 1)
+    changed.freeze()
+    assert not changed.load_hierarchy(path)
+    assert changed.hierarchy is None
+    assert not math.isinf(changed.shortest_path(0, 1, "ch")[1])
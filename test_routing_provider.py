@@ -0,0 +1,136 @@
+"""RoutingProviderClient retries and circuit breaker against a local stub server"""
+import http.server
+import importlib.util
+import json
+import os
+import threading
+import time
+
+import pytest
+
+# Importing the app pings MongoDB; don't wait 30s for a server the client code never uses
+os.environ.setdefault("MONGO_URI", "mongodb://localhost:27017/?serverSelectionTimeoutMS=100")
+
+spec = importlib.util.spec_from_file_location(
+    "ats", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ATS(Tamayo).py"))
+ats = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(ats)
+
+OK = (200, {"status": "OK", "routes": []})
+
+
+class StubHandler(http.server.BaseHTTPRequestHandler):
+    """Answers each GET with the next scripted (status, body), repeating the last one"""
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            server.requests.append(self.path)
+            status, body = server.responses[0] if len(server.responses) == 1 else server.responses.pop(0)
+        time.sleep(server.delay)
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def stub():
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.responses = [OK]
+    server.delay = 0.0
+    server.url = f"http://127.0.0.1:{server.server_address[1]}/directions"
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def client(stub, **options):
+    options = {"retries": 2, "backoff": 0.0, "failure_threshold": 2, "reset_after": 0.2, **options}
+    return ats.RoutingProviderClient("test-key", base_url=stub.url, **options)
+
+
+def test_success_sends_route_parameters(stub):
+    data = client(stub).directions("Home", "Central Park")
+    assert data["status"] == "OK"
+    assert len(stub.requests) == 1
+    assert "origin=Home" in stub.requests[0] and "key=test-key" in stub.requests[0]
+
+
+def test_retries_server_errors_then_succeeds(stub):
+    stub.responses = [(503, {}), (500, {}), OK]
+    provider = client(stub)
+    assert provider.directions("Home", "Central Park")["status"] == "OK"
+    assert len(stub.requests) == 3
+    assert provider.consecutive_failures == 0
+
+
+def test_retries_provider_status(stub):
+    stub.responses = [(200, {"status": "OVER_QUERY_LIMIT"}), OK]
+    assert client(stub).directions("Home", "Central Park")["status"] == "OK"
+    assert len(stub.requests) == 2
+
+
+def test_client_errors_fail_fast_without_tripping_breaker(stub):
+    stub.responses = [(403, {"error_message": "bad key"})]
+    provider = client(stub)
+    for _ in range(3):
+        with pytest.raises(ats.RoutingProviderError, match="HTTP 403"):
+            provider.directions("Home", "Central Park")
+    assert len(stub.requests) == 3
+    assert provider.available()
+
+
+def test_read_timeout_is_retried_and_reported(stub):
+    stub.delay = 0.5
+    provider = client(stub, retries=1, read_timeout=0.05)
+    with pytest.raises(ats.RoutingProviderError):
+        provider.directions("Home", "Central Park")
+    assert len(stub.requests) == 2
+    assert provider.consecutive_failures == 1
+
+
+def test_circuit_opens_after_threshold(stub):
+    stub.responses = [(500, {})]
+    provider = client(stub, retries=0)
+    for _ in range(2):
+        with pytest.raises(ats.RoutingProviderError, match="HTTP 500"):
+            provider.directions("Home", "Central Park")
+    assert not provider.available()
+
+    # Open: calls fail without reaching the provider
+    with pytest.raises(ats.RoutingProviderError, match="circuit open"):
+        provider.directions("Home", "Central Park")
+    assert len(stub.requests) == 2
+
+
+def test_half_open_probe_closes_or_reopens_circuit(stub):
+    stub.responses = [(500, {})]
+    provider = client(stub, retries=0)
+    for _ in range(2):
+        with pytest.raises(ats.RoutingProviderError):
+            provider.directions("Home", "Central Park")
+
+    # A failed probe after reset_after opens the circuit again straight away
+    time.sleep(0.25)
+    assert provider.available()
+    with pytest.raises(ats.RoutingProviderError, match="HTTP 500"):
+        provider.directions("Home", "Central Park")
+    assert not provider.available()
+
+    # A successful probe closes it
+    time.sleep(0.25)
+    stub.responses = [OK]
+    assert provider.directions("Home", "Central Park")["status"] == "OK"
+    assert provider.available()
+    assert provider.consecutive_failures == 0
+    assert len(stub.requests) == 4